@@ -1,12 +1,48 @@
 import { NextRequest, NextResponse } from 'next/server';
 
-// This API route serves as a proxy to the agent endpoint of the ai service. 
-// It is necessary to send requests from the Next.js backend rather than the client. 
+// This API route serves as a proxy to the agent endpoint of the ai service.
+// It is necessary to send requests from the Next.js backend rather than the client.
 // This approach prevents exposing the AI service as a public endpoint and eliminates the need to implement authentication logic.
 // The mode elegant way is to use server actions, but it is not possible with streaming response.
 
 const AGENT_URL = process.env.NEXT_PUBLIC_AGENT_URL;
 
+// Forwards the agent event stream. If the agent connection drops, the stream is aborted
+// so the client notices and resumes it with the last event id (see GET).
+function forwardStream(response: Response): Response {
+  const stream = new TransformStream();
+  const writer = stream.writable.getWriter();
+
+  (async () => {
+    try {
+      const reader = response.body?.getReader();
+      if (!reader) throw new Error('No reader available');
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) {
+          await writer.close();
+          break;
+        }
+
+        // Just forward the raw chunks
+        await writer.write(value);
+      }
+    } catch (error) {
+      console.error('Stream processing error:', error);
+      await writer.abort(error);
+    }
+  })();
+
+  return new Response(stream.readable, {
+    headers: {
+      'Content-Type': 'text/event-stream',
+      'Cache-Control': 'no-cache',
+      'Connection': 'keep-alive',
+    },
+  });
+}
+
 export async function POST(request: NextRequest) {
   const body = await request.json();
 
@@ -16,7 +52,7 @@ export async function POST(request: NextRequest) {
       headers: {
         'Content-Type': 'application/json',
         'Accept': 'text/event-stream',
-        "x-tenant-id": "f436cc35-e7af-411d-b4b0-63d3ee183523", 
+        "x-tenant-id": "f436cc35-e7af-411d-b4b0-63d3ee183523",
       },
       body: JSON.stringify(body),
     });
@@ -26,47 +62,44 @@ export async function POST(request: NextRequest) {
       throw new Error(error.detail || 'Failed to call agent');
     }
 
-    const stream = new TransformStream();
-    const writer = stream.writable.getWriter();
-
-    (async () => {
-      try {
-        const reader = response.body?.getReader();
-        if (!reader) throw new Error('No reader available');
+    return forwardStream(response);
 
-        while (true) {
-          const { done, value } = await reader.read();
-          if (done) {
-            await writer.close();
-            break;
-          }
-
-          // Just forward the raw chunks
-          await writer.write(value);
-        }
-      } catch (error) {
-        console.error('Stream processing error:', error);
+  } catch (error) {
+    console.error('Error in agent route', error);
+    return NextResponse.json(
+      { error: 'Failed to process /agent request' },
+      { status: 500 }
+    );
+  }
+}
 
-        // Write an error message to the stream before closing
-        const errorData = JSON.stringify({ error: "Error in agent" });
-        await writer.write(new TextEncoder().encode(`event: error\ndata: ${errorData}\n\n`));
-        await writer.close();
-      }
-    })();
+// Resumes the event stream of the latest run of a thread after the Last-Event-ID.
+export async function GET(request: NextRequest) {
+  const threadId = request.nextUrl.searchParams.get('thread_id');
+  const lastEventId = request.headers.get('Last-Event-ID');
 
-    return new Response(stream.readable, {
+  try {
+    const response = await fetch(`${AGENT_URL}/agent/stream?${new URLSearchParams({ thread_id: threadId ?? '' })}`, {
+      method: 'GET',
       headers: {
-        'Content-Type': 'text/event-stream',
-        'Cache-Control': 'no-cache',
-        'Connection': 'keep-alive',
+        'Accept': 'text/event-stream',
+        "x-tenant-id": "f436cc35-e7af-411d-b4b0-63d3ee183523",
+        ...(lastEventId ? { 'Last-Event-ID': lastEventId } : {}),
       },
     });
 
+    if (!response.ok) {
+      const error = await response.json();
+      return NextResponse.json({ detail: error.detail || 'Failed to resume agent stream' }, { status: response.status });
+    }
+
+    return forwardStream(response);
+
   } catch (error) {
     console.error('Error in agent route', error);
     return NextResponse.json(
-      { error: 'Failed to process /agent request' },
+      { error: 'Failed to process /agent/stream request' },
       { status: 500 }
     );
   }
-} 
\ No newline at end of file
+}
@@ -1,11 +1,20 @@
 'use server';
 
-import { Checkpoint } from './types';
+import { Checkpoint, CheckpointTreeEntry } from './types';
 
 const AGENT_URL = process.env.NEXT_PUBLIC_AGENT_URL;
 
-export async function getHistory<TAgentState, TInterruptValue>(threadId: string): Promise<Checkpoint<TAgentState, TInterruptValue>[]> {
-  const response = await fetch(`${AGENT_URL}/history?thread_id=${threadId}`, {
+/**
+ * Returns checkpoints history, newest first.
+ * @param limit - maximum number of checkpoints to return
+ * @param before - checkpoint id to start after. Pass the id of the last checkpoint of the previous page.
+ */
+export async function getHistory<TAgentState, TInterruptValue>(threadId: string, limit?: number, before?: string): Promise<Checkpoint<TAgentState, TInterruptValue>[]> {
+  const params = new URLSearchParams({ thread_id: threadId });
+  if (limit) params.set('limit', String(limit));
+  if (before) params.set('before', before);
+
+  const response = await fetch(`${AGENT_URL}/history?${params}`, {
     method: "GET",
     headers: {
       "Content-Type": "application/json",
@@ -22,6 +31,27 @@ export async function getHistory<TAgentState, TInterruptValue>(threadId: string)
   return data as Checkpoint<TAgentState, TInterruptValue>[];
 }
 
+/**
+ * Returns the branch tree of the thread: checkpoint ids with their parent ids, oldest first.
+ * Much cheaper than the history for long threads, as no states are loaded.
+ */
+export async function getHistoryTree(threadId: string): Promise<CheckpointTreeEntry[]> {
+  const response = await fetch(`${AGENT_URL}/history/tree?${new URLSearchParams({ thread_id: threadId })}`, {
+    method: "GET",
+    headers: {
+      "Content-Type": "application/json",
+      "x-tenant-id": "f436cc35-e7af-411d-b4b0-63d3ee183523",
+    },
+  });
+
+  if (!response.ok) {
+    const error = await response.json();
+    throw new Error(error.detail || 'Failed to fetch agent history tree');
+  }
+
+  return await response.json() as CheckpointTreeEntry[];
+}
+
 export async function stopAgent(threadId: string): Promise<void> {
   const response = await fetch(`${AGENT_URL}/agent/stop`, {
     method: 'POST',
@@ -23,6 +23,9 @@ function parseSSEMessage<TAgentState, TInterruptValue>(chunk: string): AgentEven
     const [field, ...valueArr] = line.split(':');
     const value = valueArr.join(':').trim();
     switch (field) {
+      case 'id':
+        currentMessage.id = value;
+        break;
       case 'event':
         currentMessage.event = value;
         break;
@@ -39,11 +42,48 @@ function parseSSEMessage<TAgentState, TInterruptValue>(chunk: string): AgentEven
   return messages;
 }
 
+// Reconnects after a dropped connection. The agent resends the events after the last received event id.
+const MAX_RECONNECT_ATTEMPTS = 5;
+const RECONNECT_DELAY_MS = 500;
+
+async function* readEvents<TAgentState, TInterruptValue>(response: Response): AsyncGenerator<AgentEvent<TAgentState, TInterruptValue>, void, unknown> {
+  const reader = response.body?.getReader();
+  if (!reader) throw new Error('No reader available');
+
+  const decoder = new TextDecoder();
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+
+    const chunk = decoder.decode(value);
+
+    const parsedMessages = parseSSEMessage<TAgentState, TInterruptValue>(chunk);
+    for (const msg of parsedMessages) {
+      yield msg;
+    }
+  }
+}
+
+async function resumeAgentRoute(threadId: string, lastEventId?: string): Promise<Response> {
+  const params = new URLSearchParams({ thread_id: threadId });
+  const response = await fetch(`/api/agent?${params}`, {
+    method: 'GET',
+    headers: lastEventId ? { 'Last-Event-ID': lastEventId } : {},
+  });
+
+  if (!response.ok) {
+    const error = await response.json();
+    throw new Error(error.detail || 'Failed to resume agent stream');
+  }
+  return response;
+}
+
 export async function* callAgentRoute<TAgentState, TInterruptValue, TResumeValue>(
   body: RunAgentInputInternal<TAgentState> | ResumeAgentInputInternal<TResumeValue> | ForkAgentInputInternal<TAgentState> | ReplayAgentInputInternal):
   AsyncGenerator<AgentEvent<TAgentState, TInterruptValue>, void, unknown> {
   try {
-    const response = await fetch('/api/agent', {
+    let response = await fetch('/api/agent', {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -56,21 +96,22 @@ export async function* callAgentRoute<TAgentState, TInterruptValue, TResumeValue
       throw new Error(error.detail || 'Failed to call agent route');
     }
 
-    const reader = response.body?.getReader();
-    if (!reader) throw new Error('No reader available');
-
-    const decoder = new TextDecoder();
-
+    let lastEventId: string | undefined;
+    let attempts = 0;
     while (true) {
-      const { done, value } = await reader.read();
-      if (done) break;
-
-      const chunk = decoder.decode(value);
-      console.log("Chunk => ", chunk)
-
-      const parsedMessages = parseSSEMessage<TAgentState, TInterruptValue>(chunk);
-      for (const msg of parsedMessages) {
-        yield msg;
+      try {
+        for await (const msg of readEvents<TAgentState, TInterruptValue>(response)) {
+          if (msg.id) lastEventId = msg.id;
+          attempts = 0;
+          yield msg;
+        }
+        return;
+      } catch (error) {
+        if (attempts >= MAX_RECONNECT_ATTEMPTS) throw error;
+        attempts++;
+        console.warn(`Agent stream interrupted, reconnecting (${attempts}/${MAX_RECONNECT_ATTEMPTS})`, error);
+        await new Promise(resolve => setTimeout(resolve, RECONNECT_DELAY_MS * attempts));
+        response = await resumeAgentRoute(body.thread_id, lastEventId);
       }
     }
   } catch (error) {
@@ -1,8 +1,9 @@
-import { Checkpoint } from "./types";
+import { Checkpoint, CheckpointTreeEntry } from "./types";
 
 interface TreeNode {
   id: string;
   next?: string;
+  source?: string;
   state?: any;
   children: TreeNode[];
 }
@@ -42,6 +43,28 @@ function buildTree<TAgentState, TInterruptValue>(checkpoints: Checkpoint<TAgentS
   return roots;
 }
 
+// Builds the tree from the branch tree entries returned by getHistoryTree. Entries have no state.
+function buildTreeFromEntries(entries: CheckpointTreeEntry[]): TreeNode[] {
+  const nodes = new Map<string, TreeNode>();
+  const roots: TreeNode[] = [];
+
+  entries.forEach(entry => {
+    nodes.set(entry.checkpoint_id, { id: entry.checkpoint_id, source: entry.source, children: [] });
+  });
+
+  entries.forEach(entry => {
+    const node = nodes.get(entry.checkpoint_id)!;
+    const parent = entry.parent_checkpoint_id ? nodes.get(entry.parent_checkpoint_id) : undefined;
+    if (parent) {
+      parent.children.push(node);
+    } else {
+      roots.push(node);
+    }
+  });
+
+  return roots;
+}
+
 interface PrintOptions {
   showState?: boolean;
   renderState?: (state: any) => string;
@@ -63,6 +86,9 @@ function printTreeNode(node: TreeNode, options: PrintOptions = {}, prefix: strin
   if (node.next) {
     result += ` → ${node.next}`;
   }
+  if (node.source) {
+    result += ` (${node.source})`;
+  }
   if (options.showState && node.state) {
     const renderFn = options.renderState || defaultRenderState;
     result += " " + renderFn(node.state);
@@ -90,4 +116,15 @@ export function printCheckpointTree<TAgentState, TInterruptValue>(checkpoints: C
   });
 
   return result;
-} 
\ No newline at end of file
+}
+
+export function printBranchTree(entries: CheckpointTreeEntry[], options: PrintOptions = {}): string {
+  const roots = buildTreeFromEntries(entries);
+  let result = "";
+
+  roots.forEach((root, index) => {
+    result += printTreeNode(root, options, "", index === roots.length - 1);
+  });
+
+  return result;
+}
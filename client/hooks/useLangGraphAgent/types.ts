@@ -36,6 +36,33 @@ export interface Checkpoint<TAgentState, TInterruptValue> {
   interrupts?: Interrupt<TInterruptValue>[];
   parent_config?: CheckpointConfig;
   metadata?: CheckpointMetadata;
+  messages_delta?: MessagesDelta;
+}
+
+/** Checkpoint of the branch tree of a thread, without its state (see getHistoryTree).
+ * @param children - number of child checkpoints. Forks have more than one.
+ */
+export interface CheckpointTreeEntry {
+  checkpoint_id: string;
+  parent_checkpoint_id: string | null;
+  ts: string;
+  step: number;
+  source: string;
+  children: number;
+}
+
+/** Messages of the checkpoint sent as a difference to the previous checkpoint of the stream.
+ * Sent instead of values.messages when the agent is called with checkpoint_delta.
+ * @param keyframe - true if append contains the full list of messages
+ * @param keep - number of messages to keep from the previous checkpoint
+ * @param update - kept messages that have changed, matched by id
+ * @param append - new messages appended after the kept ones
+ */
+export interface MessagesDelta {
+  keyframe: boolean;
+  keep: number;
+  update: Message[];
+  append: Message[];
 }
 
 /** Graph checkpoint in the application.
@@ -55,6 +82,8 @@ export interface AppCheckpoint<TAgentState, TInterruptValue> {
   interruptValue?: TInterruptValue;
   checkpointConfig: CheckpointConfig;
   error: boolean;
+  /** Set when the run was stopped in this checkpoint. Replay stopped.config to run the nodes in stopped.next. */
+  stopped?: Stopped;
 }
 
 /** Node that is executed in the checkpoint.
@@ -99,11 +128,19 @@ export interface WithMessages {
 }
 
 /** Events that are emitted by the agent.
- * @param event - event type. Can be 'checkpoint', 'message_chunk', 'interrupt', 'custom', 'error'.
+ * @param event - event type. Can be 'checkpoint', 'message_chunk', 'interrupt', 'custom', 'stopped', 'error'.
  */
 export interface AgentEvent<TAgentState, TInterruptValue> {
+  /** "<run_id>:<seq>". Sent as Last-Event-ID to resume the stream after a dropped connection. */
+  id?: string
   event: string
-  data: Checkpoint<TAgentState, TInterruptValue> | NodeMessageChunk | Interrupt<TInterruptValue>[] | TAgentState;
+  data: Checkpoint<TAgentState, TInterruptValue> | NodeMessageChunk | Interrupt<TInterruptValue>[] | TAgentState | Stopped;
+}
+
+/** Last event of a stopped run. Config is the last checkpoint saved before the run was cancelled, next are the nodes that didn't finish. */
+export interface Stopped {
+  next: string[];
+  config: CheckpointConfig;
 }
 
 /** Generic interface for an agent input. Thread id is required. */
@@ -111,6 +148,11 @@ interface AgentInput {
   thread_id: string;
 }
 
+/** Options of the agent request that are set by the hook. */
+interface AgentInputInternal {
+  checkpoint_delta?: boolean;
+}
+
 export interface RunAgentInput<TAgentState> extends AgentInput {
   state: Partial<TAgentState>;
 }
@@ -119,27 +161,31 @@ export interface ResumeAgentInput<TResumeValue> extends AgentInput {
   resume: TResumeValue;
 }
 
+/** Only the part of state that differs from the forked checkpoint is stored.
+ * @param as_node - node the state update is attributed to. Decides which nodes run next.
+ */
 export interface ForkAgentInput<TAgentState> extends AgentInput {
   config: CheckpointConfig;
   state: Partial<TAgentState>;
+  as_node?: string;
 }
 
 export interface ReplayAgentInput extends AgentInput {
   config: CheckpointConfig;
 }
 
-export interface RunAgentInputInternal<TAgentState> extends RunAgentInput<TAgentState> {
+export interface RunAgentInputInternal<TAgentState> extends RunAgentInput<TAgentState>, AgentInputInternal {
   type: "run";
 }
 
-export interface ResumeAgentInputInternal<TResumeValue> extends ResumeAgentInput<TResumeValue> {
+export interface ResumeAgentInputInternal<TResumeValue> extends ResumeAgentInput<TResumeValue>, AgentInputInternal {
   type: "resume";
 }
 
-export interface ForkAgentInputInternal<TAgentState> extends ForkAgentInput<TAgentState> {
+export interface ForkAgentInputInternal<TAgentState> extends ForkAgentInput<TAgentState>, AgentInputInternal {
   type: "fork";
 }
 
-export interface ReplayAgentInputInternal extends ReplayAgentInput {
+export interface ReplayAgentInputInternal extends ReplayAgentInput, AgentInputInternal {
   type: "replay";
 }
\ No newline at end of file
@@ -15,6 +15,8 @@ import {
   ToolCall,
   WithMessages,
   NodeMessageChunk,
+  Message,
+  Stopped,
 } from './types';
 import { callAgentRoute } from './api';
 import { getHistory, stopAgent } from './actions';
@@ -86,7 +88,7 @@ export function useLangGraphAgent<TAgentState extends object | WithMessages, TIn
   }
 
   /**
-   * Stops the agent execution. Agent will not stop immediately. It will stop before emitting the last event (see {@link AgentEvent}).
+   * Stops the agent execution. The run is cancelled immediately, including running nodes, and the last event is 'stopped' (see {@link AgentEvent}).
    * @param threadId - The ID of the thread to stop.
    */
   async function stop(threadId: string) {
@@ -121,11 +123,18 @@ export function useLangGraphAgent<TAgentState extends object | WithMessages, TIn
       // Invalidate cache when agent is called
       historyCache.delete(agentInput.thread_id);
 
-      const messageStream = callAgentRoute<TAgentState, TInterruptValue, TResumeValue>(agentInput);
+      // Messages of the last checkpoint of the stream. Used to rebuild messages from deltas.
+      let streamMessages: Message[] = [];
+
+      const messageStream = callAgentRoute<TAgentState, TInterruptValue, TResumeValue>({ ...agentInput, checkpoint_delta: true });
       for await (const msg of messageStream) {
 
         if (msg.event === 'checkpoint') {
-          processCheckpoint(msg.data as Checkpoint<TAgentState, TInterruptValue>, appCheckpoints);
+          const checkpoint = msg.data as Checkpoint<TAgentState, TInterruptValue>;
+          if (checkpoint.messages_delta) {
+            streamMessages = applyMessagesDelta(checkpoint, streamMessages);
+          }
+          processCheckpoint(checkpoint, appCheckpoints);
           setAppCheckpoints([...appCheckpoints]);
         }
 
@@ -144,6 +153,11 @@ export function useLangGraphAgent<TAgentState extends object | WithMessages, TIn
           setAppCheckpoints([...appCheckpoints]);
         }
 
+        if (msg.event === 'stopped') {
+          processStopped(msg.data as Stopped, appCheckpoints);
+          setAppCheckpoints([...appCheckpoints]);
+        }
+
         if (msg.event === 'error') {
           processError(appCheckpoints);
           setAppCheckpoints([...appCheckpoints]);
@@ -273,6 +287,22 @@ export function useLangGraphAgent<TAgentState extends object | WithMessages, TIn
     }
   }
 
+  /**
+   * Rebuilds checkpoint values.messages from the messages delta and the messages of the previous checkpoint.
+   * Returns the rebuilt messages.
+   */
+  function applyMessagesDelta(checkpoint: Checkpoint<TAgentState, TInterruptValue>, previousMessages: Message[]): Message[] {
+    const delta = checkpoint.messages_delta!;
+    const updates = new Map(delta.update.map(x => [x.id, x]));
+    const messages = delta.keyframe
+      ? [...delta.append]
+      : [...previousMessages.slice(0, delta.keep).map(x => updates.get(x.id) ?? x), ...delta.append];
+
+    (checkpoint.values as unknown as WithMessages).messages = messages;
+    delete checkpoint.messages_delta;
+    return messages;
+  }
+
   function createAppCheckpoint(checkpoint: Checkpoint<TAgentState, TInterruptValue>): AppCheckpoint<TAgentState, TInterruptValue> {
     return {
       nodes: checkpoint.next.map((x, index) => {
@@ -391,6 +421,15 @@ export function useLangGraphAgent<TAgentState extends object | WithMessages, TIn
     lastCheckpoint.interruptValue = interrupts[0].value; // handle only single interrupt for now
   }
 
+  function processStopped(stopped: Stopped, appCheckpoints: AppCheckpoint<TAgentState, TInterruptValue>[]) {
+    if (appCheckpoints.length === 0) {
+      return;
+    }
+
+    const lastCheckpoint = appCheckpoints[appCheckpoints.length - 1];
+    lastCheckpoint.stopped = stopped;
+  }
+
   function processError(appCheckpoints: AppCheckpoint<TAgentState, TInterruptValue>[]) {
     if (appCheckpoints.length === 0) {
       return;
@@ -0,0 +1,75 @@
+import time
+from collections import OrderedDict
+from typing import Callable
+
+
+class LRUCache:
+    """In-process LRU cache with optional TTL and hit/miss counters.
+
+    If max_bytes is set, values are also evicted when the total of sizeof(value) exceeds it.
+    """
+
+    def __init__(self, maxsize: int, ttl: float | None = None, max_bytes: int | None = None,
+                 sizeof: Callable[[object], int] | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 0)
+        self.items = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        item = self.items.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        value, expires_at, _ = item
+        if expires_at is not None and expires_at < time.monotonic():
+            self.delete(key)
+            self.misses += 1
+            return default
+        self.items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key, default=None):
+        """Value without updating recency, counters or expiry."""
+        item = self.items.get(key)
+        return item[0] if item is not None else default
+
+    def set(self, key, value):
+        self.delete(key)
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        self.items[key] = (value, expires_at, size)
+        self.bytes += size
+        while len(self.items) > self.maxsize or (self.max_bytes is not None and self.bytes > self.max_bytes):
+            _, (_, _, evicted_size) = self.items.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def delete(self, key):
+        item = self.items.pop(key, None)
+        if item is not None:
+            self.bytes -= item[2]
+
+    def clear(self):
+        self.items.clear()
+        self.bytes = 0
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def stats(self) -> dict:
+        stats = {"size": len(self.items), "hits": self.hits, "misses": self.misses}
+        if self.max_bytes is not None:
+            stats.update({"bytes": self.bytes, "evictions": self.evictions})
+        return stats
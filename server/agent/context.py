@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+from typing import TypedDict
+from dotenv import load_dotenv
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from langgraph.constants import TAG_NOSTREAM
+from .llm import get_chat_model
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+load_dotenv()
+
+# Older messages are trimmed when the messages sent to the chatbot exceed CONTEXT_MAX_TOKENS,
+# until they fit in CONTEXT_TARGET_TOKENS.
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "12000"))
+CONTEXT_TARGET_TOKENS = int(os.getenv("CONTEXT_TARGET_TOKENS", "8000"))
+# Summarize trimmed messages instead of dropping them
+CONTEXT_SUMMARIZE = os.getenv("CONTEXT_SUMMARIZE", "true").lower() == "true"
+CONTEXT_SUMMARY_MODEL = os.getenv("CONTEXT_SUMMARY_MODEL", "gpt-4o-mini")
+
+# Tokens added by the chat format to every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+encoding = tiktoken.get_encoding("o200k_base") if tiktoken else None
+
+summary_prompt = """Summarize the conversation below for an assistant that will continue it.
+Keep the facts, decisions, user preferences and open requests. Be concise.
+
+{summary}
+
+Conversation:
+{conversation}"""
+
+
+class ContextState(TypedDict, total=False):
+    """State used to bound the messages sent to the chatbot.
+
+    message_tokens - token count of each message in messages, by message id and content hash, so a
+        message edited in place (e.g. by a fork) is counted again. Only new or changed messages are counted.
+    summary - summary of messages[:summary_until]. Stored in the checkpoint, so it isn't recomputed.
+    summary_until - index of the first message sent to the LLM after the summary.
+    """
+    message_tokens: dict[str, int]
+    summary: str
+    summary_until: int
+
+
+def message_text(msg) -> str:
+    if isinstance(msg, BaseMessage):
+        content, tool_calls = msg.content, getattr(msg, "tool_calls", None)
+    else:
+        content, tool_calls = msg.get("content"), msg.get("tool_calls")
+    text = content if isinstance(content, str) else json.dumps(content, default=str)
+    if tool_calls:
+        text += json.dumps(tool_calls, default=str)
+    return text
+
+
+def token_key(msg, text: str) -> str:
+    msg_id = msg.id if isinstance(msg, BaseMessage) else msg.get("id")
+    return f"{msg_id}:{hashlib.sha256(text.encode()).hexdigest()[:16]}"
+
+
+def count_tokens(msg, text: str | None = None) -> int:
+    if text is None:
+        text = message_text(msg)
+    tokens = len(encoding.encode(text, disallowed_special=())) if encoding else len(text) // 4
+    return tokens + MESSAGE_OVERHEAD_TOKENS
+
+
+def is_turn_start(msg) -> bool:
+    """Messages before a human message never have pending tool calls,
+    so cutting there keeps every tool call together with its ToolMessage."""
+    if isinstance(msg, BaseMessage):
+        return isinstance(msg, HumanMessage)
+    return msg.get("type") in ("human", "user") or msg.get("role") == "user"
+
+
+async def summarize(summary: str | None, messages: list) -> str:
+    conversation = "\n".join(
+        f"{msg.type if isinstance(msg, BaseMessage) else msg.get('type')}: "
+        f"{msg.content if isinstance(msg, BaseMessage) else msg.get('content')}"
+        for msg in messages)
+    prompt = summary_prompt.format(
+        summary=f"Summary of the earlier conversation:\n{summary}" if summary else "",
+        conversation=conversation)
+    llm = get_chat_model(CONTEXT_SUMMARY_MODEL, temperature=0)
+    # Not streamed to the client as a chatbot message
+    response = await llm.ainvoke(prompt, config={"tags": [TAG_NOSTREAM]})
+    return response.content
+
+
+async def prepare_context(state: dict) -> tuple[list, dict]:
+    """Return the messages to send to the LLM and the state update to store with the chatbot response."""
+    messages = state["messages"]
+    # Checkpoints written before the counts were keyed by message have a list
+    counted = state.get("message_tokens")
+    counted = counted if isinstance(counted, dict) else {}
+    summary = state.get("summary")
+    summary_until = state.get("summary_until") or 0
+
+    if summary_until > len(messages):
+        # Messages have been removed, the summary index is no longer valid
+        summary, summary_until = None, 0
+
+    # Only the counts of the current messages are kept
+    message_tokens = {}
+    tokens = []
+    for msg in messages:
+        text = message_text(msg)
+        key = token_key(msg, text)
+        if key not in message_tokens:
+            message_tokens[key] = counted[key] if key in counted else count_tokens(msg, text)
+        tokens.append(message_tokens[key])
+
+    summary_tokens = len(summary) // 4 if summary else 0
+    total = summary_tokens + sum(tokens[summary_until:])
+
+    if total > CONTEXT_MAX_TOKENS:
+        # Move the start to the first turn after which the rest fits in the target.
+        # The last turn is always kept.
+        cut = summary_until
+        remaining = total
+        for i in range(summary_until + 1, len(messages)):
+            remaining -= tokens[i - 1]
+            if is_turn_start(messages[i]):
+                cut = i
+                if remaining <= CONTEXT_TARGET_TOKENS:
+                    break
+
+        if cut > summary_until:
+            if CONTEXT_SUMMARIZE:
+                summary = await summarize(summary, messages[summary_until:cut])
+            summary_until = cut
+
+    llm_messages = messages[summary_until:]
+    if summary:
+        llm_messages = [SystemMessage(content=f"Summary of the earlier conversation:\n{summary}")] + llm_messages
+
+    return llm_messages, {"message_tokens": message_tokens, "summary": summary or "", "summary_until": summary_until}
@@ -14,8 +14,13 @@ from psycopg_pool import AsyncConnectionPool
 from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
 import random
 import asyncio
-import requests
 import os
+from .llm import get_chat_model
+from .tools import tool_registry, McpToolNodeArgs
+from .context import ContextState, prepare_context
+from .response_cache import response_cache
+from .prefix_stats import prefix_stats
+from langchain_core.runnables import RunnableConfig
 
 load_dotenv()
 
@@ -62,101 +67,10 @@ class Weather(TypedDict):
     result: str
 
 
-class State(MessagesState):
+class State(MessagesState, ContextState):
     weather_forecast: Annotated[list[Weather], operator.add]
 
 
-class WeatherInput(TypedDict):
-    location: str
-    tool_call_id: str
-
-
-class ToolNodeArgs(TypedDict):
-    name: str
-    args: dict[str, Any]
-    id: str
-
-
-class McpToolNodeArgs(TypedDict):
-    server_name: str
-    name: str
-    args: dict[str, Any]
-    id: str
-
-
-@tool
-async def weather_tool(query: str) -> str:
-    """Call to get current weather"""
-    return "Sunny"
-
-
-@tool
-async def create_reminder_tool(reminder_text: str) -> str:
-    """Call to create a reminder"""
-    return "Reminder created"
-
-@tool
-async def check_calendar_availability_tool(day: str, person_name: str) -> str:
-    """Check calendar availability for a given day."""
-    # Placeholder response - in real app would check actual calendar
-    return f"Check calendar tool"
-
-class WeatherData(TypedDict):
-    """Generated SQL query."""
-    location: str
-    longitude: str
-    latitude: str
-
-
-async def weather(input: WeatherInput, writer: StreamWriter):
-    location = input["args"]["query"]
-
-    llm = ChatOpenAI(temperature=0, model="gpt-4o")
-    structured_llm = llm.with_structured_output(WeatherData)
-
-    result = await structured_llm.ainvoke(f"Longitude and latitude of : {location}")
-
-    url = f'https://api.openweathermap.org/data/2.5/weather?lat={result['latitude']}&lon={result['longitude']}&appid={os.getenv("OPENWEATHER_API_KEY")}'
-
-    # Send custom event to the client. It will update the state of the last checkpoint and all child nodes.
-    # Note: if there are multiple child nodes (e.g. parallel nodes), the state will be updated for all of them.
-    writer({"weather_forecast": [
-           {"location": location, "search_status": f"Checking weather in {location}"}]})
-
-    response = requests.get(url)
-    # await asyncio.sleep(2)
-    # weather = random.choice(["Sunny", "Cloudy", "Rainy", "Snowy"])
-
-    # Check if the request was successful
-    if response.status_code == 200:
-        data = response.json()  # Parse the JSON response
-        print(data)  # Print the weather data
-    else:
-        print(f"Error: {response.status_code}")  # Print the error code
-
-    weather = data["weather"][0]["main"]
-    print(weather)
-    return {"messages": [ToolMessage(content=weather, tool_call_id=input["id"])], "weather_forecast": [{"location": location, "search_status": "", "result": weather}]}
-
-
-
-async def check_calendar_availability(input: ToolNodeArgs):
-    name = interrupt(input['args']['person_name'])
-
-    if name:
-        res =  f"Available times on {input['args']['day']}: 9:00 AM, 2:00 PM, 4:00 PM"
-
-
-
-    return {"messages": [ToolMessage(content=res, tool_call_id=input["id"])]}
-
-async def reminder(input: ToolNodeArgs):
-    res = interrupt(input['args']['reminder_text'])
-
-    tool_answer = "Reminder created." if res == 'approve' else "Reminder creation cancelled by user."
-
-    return {"messages": [ToolMessage(content=tool_answer, tool_call_id=input["id"])]}
-
 #
 # async def mcp_tool(input: McpToolNodeArgs):
 #     if input["server_name"] not in mcp_servers:
@@ -188,43 +102,18 @@ async def reminder(input: ToolNodeArgs):
 #     return {"messages": [ToolMessage(content=tool_result.content[0].text, tool_call_id=input["id"])]}
 
 
-async def chatbot(state: State):
-    tools = [
-        weather_tool,
-        create_reminder_tool,
-        check_calendar_availability_tool
-    ]
-
-    llm = ChatOpenAI(model="gpt-4o-mini").bind_tools(tools)
-    response = await llm.ainvoke(state["messages"])
-    return {"messages": [response]}
+async def chatbot(state: State, config: RunnableConfig):
+    # Older messages are replaced by a summary when the context grows over the budget
+    messages, context_update = await prepare_context(state)
+    llm = get_chat_model("gpt-4o-mini", tools=tool_registry.tools, cache=response_cache)
+    response = await llm.ainvoke(messages)
+    prefix_stats.record(config["configurable"].get("thread_id"), messages, response)
+    return {"messages": [response], **context_update}
 
 
 # Chatbot node router. Based on tool calls, creates the list of the next parallel nodes.
-def assign_tool(state: State) -> Literal["weather", "reminder","check_calendar_availability", "__end__"]:
-    messages = state["messages"]
-    last_message = messages[-1]
-    if last_message.tool_calls:
-        send_list = []
-        for tool in last_message.tool_calls:
-            if tool["name"] == 'weather_tool':
-                send_list.append(Send('weather', tool))
-            elif tool["name"] == 'create_reminder_tool':
-                send_list.append(Send('reminder', tool))
-            elif tool["name"] == 'check_calendar_availability_tool':
-                send_list.append(Send('check_calendar_availability', tool))
-
-            # elif any(tool["name"] == mcp_tool.name for mcp_tool in [tool for tools_list in mcp_servers_with_tools.values() for tool in tools_list]):
-            #     server_name = tool_to_server_lookup.get(tool["name"], None)
-            #     args = McpToolNodeArgs(
-            #         server_name=server_name,
-            #         name=tool["name"],
-            #         args=tool["args"],
-            #         id=tool["id"]
-            #     )
-            #     send_list.append(Send('mcp_tool', args))
-        return send_list if len(send_list) > 0 else "__end__"
-    return "__end__"
+# Tool nodes and MCP tools are registered in tool_registry.
+assign_tool = tool_registry.route
 
 
 # async def initialize_mcp_tools():
@@ -245,17 +134,12 @@ def assign_tool(state: State) -> Literal["weather", "reminder","check_calendar_a
 builder = StateGraph(State)
 
 builder.add_node("chatbot", chatbot)
-builder.add_node("weather", weather)
-builder.add_node("reminder", reminder)
-builder.add_node("check_calendar_availability", check_calendar_availability)
+tool_registry.add_nodes(builder, return_to="chatbot")
 
 # builder.add_node("mcp_tool", mcp_tool)
 
 builder.add_edge(START, "chatbot")
-builder.add_conditional_edges("chatbot", assign_tool)
-builder.add_edge("weather", "chatbot")
-builder.add_edge("check_calendar_availability", "chatbot")
-builder.add_edge("reminder", "chatbot")
+builder.add_conditional_edges("chatbot", assign_tool, tool_registry.path_map())
 # builder.add_edge("mcp_tool", "chatbot")
 
 builder.add_edge("chatbot", END)
@@ -0,0 +1,88 @@
+import os
+import httpx
+from dotenv import load_dotenv
+from langchain_openai import ChatOpenAI
+
+load_dotenv()
+
+# Connection pool shared by all LLM clients
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+# Models created at startup, comma separated
+LLM_WARMUP_MODELS = os.getenv("LLM_WARMUP_MODELS", "gpt-4o-mini,gpt-4o")
+
+http_async_client: httpx.AsyncClient | None = None
+
+# Clients by model, params, bound tools and structured output schema
+chat_models = {}
+
+
+def get_http_async_client() -> httpx.AsyncClient:
+    global http_async_client
+    if http_async_client is None or http_async_client.is_closed:
+        http_async_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=LLM_TIMEOUT,
+        )
+    return http_async_client
+
+
+def tool_key(tool):
+    return getattr(tool, "name", None) or getattr(tool, "__name__", None) or repr(tool)
+
+
+def get_chat_model(model: str, tools: list | None = None, structured_output=None, **params):
+    """Return a cached chat model client. All clients share one pooled HTTP client,
+    so connections are kept alive between graph steps.
+
+    :param model: OpenAI model name
+    :param tools: tools to bind with bind_tools
+    :param structured_output: schema passed to with_structured_output
+    :param params: other ChatOpenAI params, e.g. temperature
+    """
+    key = (
+        model,
+        tuple(sorted((name, repr(value)) for name, value in params.items())),
+        tuple(tool_key(tool) for tool in tools or []),
+        tool_key(structured_output) if structured_output is not None else None,
+    )
+    client = chat_models.get(key)
+    if client is None:
+        client = ChatOpenAI(model=model, http_async_client=get_http_async_client(), **params)
+        if tools:
+            client = client.bind_tools(tools)
+        if structured_output is not None:
+            client = client.with_structured_output(structured_output)
+        chat_models[key] = client
+    return client
+
+
+async def warm_up():
+    """Create clients of the commonly used models and open a connection to the API,
+    so the first graph step doesn't pay for the TLS handshake."""
+    try:
+        client = None
+        for model in filter(None, (x.strip() for x in LLM_WARMUP_MODELS.split(","))):
+            client = get_chat_model(model)
+        if client is None:
+            return
+        await get_http_async_client().get(str(client.openai_api_base or "https://api.openai.com/v1") + "/models",
+                                          headers={"Authorization": f"Bearer {client.openai_api_key.get_secret_value()}"})
+    except Exception as e:
+        print(f"Error warming up LLM connection: {str(e)}")
+
+
+async def close():
+    """Close the shared HTTP client and drop the cached clients using it.
+    Clients must be taken from get_chat_model() when used, not kept at import time."""
+    global http_async_client
+    chat_models.clear()
+    if http_async_client is not None:
+        await http_async_client.aclose()
+        http_async_client = None
@@ -0,0 +1,59 @@
+import asyncio
+import os
+import random
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+OPENWEATHER_URL = os.getenv("OPENWEATHER_URL", "https://api.openweathermap.org/data/2.5/weather")
+OPENWEATHER_TIMEOUT = float(os.getenv("OPENWEATHER_TIMEOUT", "5"))
+# Retries after the first attempt on network errors, 429 and 5xx responses
+OPENWEATHER_RETRIES = int(os.getenv("OPENWEATHER_RETRIES", "2"))
+OPENWEATHER_BACKOFF = float(os.getenv("OPENWEATHER_BACKOFF", "0.2"))
+OPENWEATHER_MAX_CONNECTIONS = int(os.getenv("OPENWEATHER_MAX_CONNECTIONS", "20"))
+
+http_client: httpx.AsyncClient | None = None
+
+
+class WeatherError(Exception):
+    """Raised when the current weather can't be fetched."""
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global http_client
+    if http_client is None or http_client.is_closed:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=OPENWEATHER_MAX_CONNECTIONS,
+                                max_keepalive_connections=OPENWEATHER_MAX_CONNECTIONS),
+            timeout=OPENWEATHER_TIMEOUT,
+        )
+    return http_client
+
+
+async def get_current_weather(latitude, longitude) -> dict:
+    """Return OpenWeather current weather data for the coordinates."""
+    params = {"lat": latitude, "lon": longitude, "appid": os.getenv("OPENWEATHER_API_KEY")}
+
+    for attempt in range(OPENWEATHER_RETRIES + 1):
+        last_attempt = attempt == OPENWEATHER_RETRIES
+        try:
+            response = await get_http_client().get(OPENWEATHER_URL, params=params)
+        except httpx.HTTPError as e:
+            if last_attempt:
+                raise WeatherError(f"Weather service is not available: {type(e).__name__}") from e
+        else:
+            if response.status_code == 200:
+                return response.json()
+            if last_attempt or (response.status_code != 429 and response.status_code < 500):
+                raise WeatherError(f"Weather service returned status {response.status_code}")
+
+        # Exponential backoff with full jitter, so parallel calls don't retry at the same moment
+        await asyncio.sleep(random.uniform(0, OPENWEATHER_BACKOFF * 2 ** attempt))
+
+
+async def close():
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
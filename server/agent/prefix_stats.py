@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+from dotenv import load_dotenv
+from .cache import LRUCache
+
+load_dotenv()
+
+# Threads for which the last sent message prefix is remembered
+PREFIX_STATS_THREADS = int(os.getenv("PREFIX_STATS_THREADS", "10000"))
+
+
+def content_version(value) -> str:
+    """Short hash identifying the content of a message without id."""
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def message_key(msg) -> str:
+    if isinstance(msg, dict):
+        return msg.get("id") or content_version(msg)
+    return msg.id or content_version([msg.type, msg.content])
+
+
+class PrefixStats:
+    """Counts how much of each LLM request repeats the previous request of the same thread.
+
+    Only the common prefix can be served from the provider prompt cache, so this shows
+    whether the prompt ordering is stable. cached_input_tokens is reported by the provider.
+    """
+
+    def __init__(self, maxsize: int = PREFIX_STATS_THREADS):
+        self.last_prefix = LRUCache(maxsize)
+        self.requests = 0
+        self.reused_requests = 0
+        self.reused_messages = 0
+        self.sent_messages = 0
+        self.input_tokens = 0
+        self.cached_input_tokens = 0
+
+    def record(self, thread_id: str | None, messages: list, response=None):
+        keys = [message_key(msg) for msg in messages]
+        self.requests += 1
+        self.sent_messages += len(keys)
+
+        if thread_id is not None:
+            previous = self.last_prefix.get(thread_id) or []
+            reused = 0
+            for old, new in zip(previous, keys):
+                if old != new:
+                    break
+                reused += 1
+            if reused:
+                self.reused_requests += 1
+                self.reused_messages += reused
+            self.last_prefix.set(thread_id, keys)
+
+        usage = getattr(response, "usage_metadata", None) or {}
+        self.input_tokens += usage.get("input_tokens", 0)
+        self.cached_input_tokens += (usage.get("input_token_details") or {}).get("cache_read", 0)
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "reused_requests": self.reused_requests,
+            "reused_messages": self.reused_messages,
+            "sent_messages": self.sent_messages,
+            "input_tokens": self.input_tokens,
+            "cached_input_tokens": self.cached_input_tokens,
+        }
+
+
+prefix_stats = PrefixStats()
+
+
+def stats() -> dict:
+    return prefix_stats.stats()
@@ -0,0 +1,183 @@
+import copy
+import hashlib
+import json
+import os
+import uuid
+from typing import Any, Sequence
+import psycopg
+from dotenv import load_dotenv
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+from langchain_core.outputs import Generation
+from psycopg_pool import AsyncConnectionPool
+from .cache import LRUCache
+from .tool_registry import ToolRegistry
+from .tools import tool_registry
+
+load_dotenv()
+
+# Opt-in cache of chatbot LLM responses
+CHATBOT_RESPONSE_CACHE = os.getenv("CHATBOT_RESPONSE_CACHE", "false").lower() == "true"
+CHATBOT_RESPONSE_CACHE_SIZE = int(os.getenv("CHATBOT_RESPONSE_CACHE_SIZE", "1000"))
+CHATBOT_RESPONSE_CACHE_TTL = float(os.getenv("CHATBOT_RESPONSE_CACHE_TTL", "3600"))
+
+# Message fields that differ between threads but don't change the meaning of the history
+ignored_message_fields = ("id", "response_metadata", "usage_metadata", "additional_kwargs", "name")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Remove message ids and metadata from the serialized history and replace tool call ids
+    by their position, so the same conversation in different threads has the same key."""
+    try:
+        messages = json.loads(prompt)
+    except ValueError:
+        return prompt
+    tool_call_ids = {}
+
+    def normalize_id(tool_call_id):
+        return tool_call_ids.setdefault(tool_call_id, f"call_{len(tool_call_ids)}")
+
+    normalized = []
+    for msg in messages if isinstance(messages, list) else [messages]:
+        kwargs = dict(msg.get("kwargs") or {}) if isinstance(msg, dict) else {}
+        for field in ignored_message_fields:
+            kwargs.pop(field, None)
+        if kwargs.get("tool_calls"):
+            kwargs["tool_calls"] = [{**tool_call, "id": normalize_id(tool_call.get("id"))}
+                                    for tool_call in kwargs["tool_calls"]]
+        if "tool_call_id" in kwargs:
+            kwargs["tool_call_id"] = normalize_id(kwargs["tool_call_id"])
+        kwargs.pop("invalid_tool_calls", None)
+        kwargs.pop("tool_call_chunks", None)
+        normalized.append([msg.get("id", [])[-1:] if isinstance(msg, dict) else None, kwargs])
+    return json.dumps(normalized, sort_keys=True, default=str)
+
+
+def with_fresh_ids(generations: Sequence[Generation]) -> list[Generation]:
+    """Copy of the cached generations with new tool call ids, so they don't collide with earlier calls of the thread."""
+    generations = copy.deepcopy(list(generations))
+    for generation in generations:
+        message = getattr(generation, "message", None)
+        if message is None:
+            continue
+        message.id = f"run-{uuid.uuid4()}"
+        ids = {}
+        for tool_call in getattr(message, "tool_calls", None) or []:
+            ids[tool_call["id"]] = tool_call["id"] = f"call_{uuid.uuid4().hex[:24]}"
+        for tool_call in message.additional_kwargs.get("tool_calls") or []:
+            tool_call["id"] = ids.get(tool_call.get("id"), tool_call.get("id"))
+    return generations
+
+
+class ChatbotResponseCache(BaseCache):
+    """LangChain LLM cache of chatbot responses.
+
+    Keyed by the normalized message history, the model params with the bound tool schemas (llm_string)
+    and the tool registry version. Entries are kept in an in-process LRU and in Postgres, both with TTL.
+    Because it is an LLM cache, hits are still reported through the LLM callbacks, so they reach the
+    client through the messages stream mode like a normal response.
+    Responses calling tools that aren't cacheable (e.g. tools with human in the loop) are not stored.
+    """
+
+    def __init__(self, registry: ToolRegistry, maxsize: int = CHATBOT_RESPONSE_CACHE_SIZE,
+                 ttl: float = CHATBOT_RESPONSE_CACHE_TTL):
+        self.registry = registry
+        self.ttl = ttl
+        self.memory = LRUCache(maxsize, ttl=ttl)
+        self.pool: AsyncConnectionPool | None = None
+        self.db_hits = 0
+        self.db_misses = 0
+        self.stores = 0
+
+    def key(self, prompt: str, llm_string: str) -> str:
+        normalized = "\n".join([normalize_prompt(prompt), llm_string, self.registry.version])
+        return hashlib.sha256(normalized.encode()).hexdigest()
+
+    def is_cacheable(self, generations: Sequence[Generation]) -> bool:
+        for generation in generations:
+            for tool_call in getattr(getattr(generation, "message", None), "tool_calls", None) or []:
+                spec = self.registry.specs.get(tool_call["name"])
+                if spec is None or not spec.cacheable:
+                    return False
+        return True
+
+    async def setup(self, db_pool: AsyncConnectionPool):
+        """Create the cache table and drop entries of other tool registry versions and expired entries."""
+        async with db_pool.connection() as conn:
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS chatbot_response_cache (
+                    key TEXT PRIMARY KEY,
+                    registry_version TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    expires_at TIMESTAMPTZ NOT NULL
+                )
+            """)
+            await conn.execute(
+                "DELETE FROM chatbot_response_cache WHERE registry_version <> %s OR expires_at < now()",
+                (self.registry.version,))
+        self.pool = db_pool
+
+    async def alookup(self, prompt: str, llm_string: str) -> Sequence[Generation] | None:
+        key = self.key(prompt, llm_string)
+        generations = self.memory.get(key)
+
+        if generations is None and self.pool is not None:
+            try:
+                async with self.pool.connection() as conn:
+                    cursor = await conn.execute(
+                        "SELECT response FROM chatbot_response_cache WHERE key = %s AND expires_at > now()", (key,))
+                    row = await cursor.fetchone()
+            except psycopg.Error as e:
+                print(f"Error reading chatbot response cache: {str(e)}")
+                row = None
+            if row:
+                self.db_hits += 1
+                generations = loads(row["response"])
+                self.memory.set(key, generations)
+            else:
+                self.db_misses += 1
+
+        return with_fresh_ids(generations) if generations is not None else None
+
+    async def aupdate(self, prompt: str, llm_string: str, return_val: Sequence[Generation]) -> None:
+        if not self.is_cacheable(return_val):
+            return
+        key = self.key(prompt, llm_string)
+        self.memory.set(key, return_val)
+        self.stores += 1
+
+        if self.pool is not None:
+            try:
+                async with self.pool.connection() as conn:
+                    await conn.execute(
+                        "INSERT INTO chatbot_response_cache (key, registry_version, response, expires_at) "
+                        "VALUES (%s, %s, %s, now() + make_interval(secs => %s)) "
+                        "ON CONFLICT (key) DO UPDATE SET response = EXCLUDED.response, expires_at = EXCLUDED.expires_at",
+                        (key, self.registry.version, dumps(list(return_val)), self.ttl))
+            except psycopg.Error as e:
+                print(f"Error writing chatbot response cache: {str(e)}")
+
+    async def aclear(self, **kwargs: Any) -> None:
+        self.memory.clear()
+        if self.pool is not None:
+            async with self.pool.connection() as conn:
+                await conn.execute("DELETE FROM chatbot_response_cache")
+
+    # The graph only calls the async methods. Sync calls behave as an in-process cache.
+    def lookup(self, prompt: str, llm_string: str) -> Sequence[Generation] | None:
+        generations = self.memory.get(self.key(prompt, llm_string))
+        return with_fresh_ids(generations) if generations is not None else None
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Generation]) -> None:
+        if self.is_cacheable(return_val):
+            self.memory.set(self.key(prompt, llm_string), return_val)
+
+    def clear(self, **kwargs: Any) -> None:
+        self.memory.clear()
+
+    def stats(self) -> dict:
+        return {**self.memory.stats(), "db_hits": self.db_hits, "db_misses": self.db_misses,
+                "stores": self.stores, "registry_version": self.registry.version}
+
+
+response_cache = ChatbotResponseCache(tool_registry) if CHATBOT_RESPONSE_CACHE else None
@@ -0,0 +1,46 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls with the same key.
+
+    The first caller starts the work, callers that arrive while it is running wait for the same
+    result (or exception) instead of repeating it. The work is cancelled only when every caller
+    waiting for it has been cancelled.
+    """
+
+    def __init__(self):
+        self.calls: dict[Hashable, asyncio.Task] = {}
+        self.waiters: dict[asyncio.Task, int] = {}
+        self.executed = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]):
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self.calls[key] = task
+            task.add_done_callback(lambda _: self.forget(key, task))
+            self.executed += 1
+        else:
+            self.shared += 1
+
+        self.waiters[task] = self.waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self.waiters[task] == 1:
+                task.cancel()
+            raise
+        finally:
+            self.waiters[task] -= 1
+            if self.waiters[task] == 0:
+                del self.waiters[task]
+
+    def forget(self, key: Hashable, task: asyncio.Task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self.calls), "executed": self.executed, "shared": self.shared}
@@ -0,0 +1,97 @@
+import asyncio
+import functools
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import Any, Callable
+from langchain_core.messages import ToolMessage
+from langchain_core.tools import BaseTool
+from langgraph.graph import StateGraph, END
+from langgraph.types import Send
+
+
+@dataclass
+class ToolSpec:
+    """Tool the LLM can call and the graph node that executes it.
+
+    :param tool: tool bound to the LLM
+    :param node_name: name of the graph node
+    :param node: node callable. Receives the tool call (name, args, id) as input.
+    :param timeout: seconds after which the node returns an error ToolMessage
+    :param cacheable: result depends only on the tool args, so LLM responses calling it can be cached
+    :param max_concurrency: maximum number of concurrently running nodes in the worker
+    """
+    tool: BaseTool
+    node_name: str
+    node: Callable
+    timeout: float | None = None
+    cacheable: bool = False
+    max_concurrency: int | None = None
+
+
+class ToolRegistry:
+    """Single source of the tools bound to the LLM, their nodes and the routing table.
+
+    Routing is a dict lookup by tool name, so it doesn't get slower as tools (e.g. MCP tools) are added.
+    """
+
+    def __init__(self):
+        self.specs: dict[str, ToolSpec] = {}
+
+    def register(self, tool: BaseTool, node_name: str, node: Callable, **metadata):
+        self.specs[tool.name] = ToolSpec(tool=tool, node_name=node_name, node=node, **metadata)
+        # Computed again on the next access
+        self.__dict__.pop("tools", None)
+        self.__dict__.pop("version", None)
+
+    @functools.cached_property
+    def tools(self) -> list[BaseTool]:
+        return [spec.tool for spec in self.specs.values()]
+
+    @functools.cached_property
+    def version(self) -> str:
+        """Hash of the tool schemas. Changes when a tool is added, removed or changed."""
+        schemas = [(spec.tool.name, spec.tool.description, spec.tool.args) for spec in self.specs.values()]
+        return hashlib.sha256(json.dumps(schemas, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+    def add_nodes(self, builder: StateGraph, return_to: str):
+        """Add a node for every tool with an edge back to the return_to node."""
+        for spec in self.specs.values():
+            builder.add_node(spec.node_name, self.wrap_node(spec))
+            builder.add_edge(spec.node_name, return_to)
+
+    def path_map(self) -> list[str]:
+        return [spec.node_name for spec in self.specs.values()] + [END]
+
+    def route(self, state) -> list[Send] | str:
+        """Conditional edge router. Based on tool calls, creates the list of the next parallel nodes."""
+        last_message = state["messages"][-1]
+        send_list = [Send(self.specs[tool_call["name"]].node_name, tool_call)
+                     for tool_call in getattr(last_message, "tool_calls", None) or []
+                     if tool_call["name"] in self.specs]
+        return send_list if send_list else END
+
+    @staticmethod
+    def wrap_node(spec: ToolSpec) -> Callable:
+        """Apply the timeout and the concurrency limit of the tool to its node.
+        functools.wraps keeps the node signature, so LangGraph still injects writer and config.
+        """
+        if spec.timeout is None and spec.max_concurrency is None:
+            return spec.node
+
+        semaphore = asyncio.Semaphore(spec.max_concurrency) if spec.max_concurrency else None
+
+        @functools.wraps(spec.node)
+        async def node(input: dict[str, Any], **kwargs):
+            try:
+                async with asyncio.timeout(spec.timeout):
+                    if semaphore is None:
+                        return await spec.node(input, **kwargs)
+                    async with semaphore:
+                        return await spec.node(input, **kwargs)
+            except TimeoutError:
+                print(f"Tool {spec.tool.name} timed out after {spec.timeout} s")
+                return {"messages": [ToolMessage(content=f"Tool {spec.tool.name} timed out.",
+                                                 tool_call_id=input["id"], status="error")]}
+
+        return node
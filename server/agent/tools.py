@@ -0,0 +1,122 @@
+import os
+from typing import TypedDict, Any
+from dotenv import load_dotenv
+from langgraph.types import StreamWriter, interrupt
+from langchain_core.messages import ToolMessage
+from langchain_core.tools import tool
+from .llm import get_chat_model
+from . import openweather, weather_cache
+from .singleflight import SingleFlight
+from .tool_registry import ToolRegistry
+
+load_dotenv()
+
+WEATHER_TOOL_TIMEOUT = float(os.getenv("WEATHER_TOOL_TIMEOUT", "30"))
+WEATHER_TOOL_MAX_CONCURRENCY = int(os.getenv("WEATHER_TOOL_MAX_CONCURRENCY", "50"))
+
+
+class WeatherInput(TypedDict):
+    location: str
+    tool_call_id: str
+
+
+class ToolNodeArgs(TypedDict):
+    name: str
+    args: dict[str, Any]
+    id: str
+
+
+class McpToolNodeArgs(TypedDict):
+    server_name: str
+    name: str
+    args: dict[str, Any]
+    id: str
+
+
+@tool
+async def weather_tool(query: str) -> str:
+    """Call to get current weather"""
+    return "Sunny"
+
+
+@tool
+async def create_reminder_tool(reminder_text: str) -> str:
+    """Call to create a reminder"""
+    return "Reminder created"
+
+
+@tool
+async def check_calendar_availability_tool(day: str, person_name: str) -> str:
+    """Check calendar availability for a given day."""
+    # Placeholder response - in real app would check actual calendar
+    return f"Check calendar tool"
+
+
+class WeatherData(TypedDict):
+    """Generated SQL query."""
+    location: str
+    longitude: str
+    latitude: str
+
+
+async def geocode(location: str):
+    structured_llm = get_chat_model("gpt-4o", structured_output=WeatherData, temperature=0)
+    result = await structured_llm.ainvoke(f"Longitude and latitude of : {location}")
+    return result["latitude"], result["longitude"]
+
+
+async def lookup_weather(location: str) -> str:
+    # Repeated locations skip the LLM call
+    latitude, longitude = await weather_cache.get_coordinates(location, geocode)
+    data = await weather_cache.get_current_weather(latitude, longitude)
+    return data["weather"][0]["main"]
+
+
+# Concurrent weather calls for the same location (parallel tool calls or other threads) share one lookup
+weather_flight = SingleFlight()
+
+
+async def weather(input: WeatherInput, writer: StreamWriter):
+    location = input["args"]["query"]
+
+    # Send custom event to the client. It will update the state of the last checkpoint and all child nodes.
+    # Note: if there are multiple child nodes (e.g. parallel nodes), the state will be updated for all of them.
+    writer({"weather_forecast": [
+           {"location": location, "search_status": f"Checking weather in {location}"}]})
+
+    try:
+        weather = await weather_flight.do(weather_cache.normalize_location(location), lambda: lookup_weather(location))
+    except (openweather.WeatherError, KeyError, IndexError, ValueError) as e:
+        print(f"Error getting weather in {location}: {str(e)}")
+        return {"messages": [ToolMessage(content=f"Could not get the weather in {location}.", tool_call_id=input["id"], status="error")],
+                "weather_forecast": [{"location": location, "search_status": "", "result": "Unknown"}]}
+
+    return {"messages": [ToolMessage(content=weather, tool_call_id=input["id"])], "weather_forecast": [{"location": location, "search_status": "", "result": weather}]}
+
+
+async def check_calendar_availability(input: ToolNodeArgs):
+    name = interrupt(input['args']['person_name'])
+
+    if name:
+        res = f"Available times on {input['args']['day']}: 9:00 AM, 2:00 PM, 4:00 PM"
+    else:
+        res = "Calendar availability check cancelled by user."
+
+    return {"messages": [ToolMessage(content=res, tool_call_id=input["id"])]}
+
+
+async def reminder(input: ToolNodeArgs):
+    res = interrupt(input['args']['reminder_text'])
+
+    tool_answer = "Reminder created." if res == 'approve' else "Reminder creation cancelled by user."
+
+    return {"messages": [ToolMessage(content=tool_answer, tool_call_id=input["id"])]}
+
+
+# Tools bound to the chatbot LLM and the nodes executing them. Used by both graph modules.
+# To add MCP tools register them with the mcp_tool node.
+tool_registry = ToolRegistry()
+tool_registry.register(weather_tool, "weather", weather, timeout=WEATHER_TOOL_TIMEOUT,
+                       cacheable=True, max_concurrency=WEATHER_TOOL_MAX_CONCURRENCY)
+tool_registry.register(create_reminder_tool, "reminder", reminder)
+tool_registry.register(check_calendar_availability_tool, "check_calendar_availability", check_calendar_availability)
@@ -0,0 +1,118 @@
+import asyncio
+import hashlib
+import os
+from typing import AsyncGenerator
+from dotenv import load_dotenv
+from pydantic import BaseModel, Field
+from typing_extensions import Literal
+from .llm import get_chat_model
+from .prompts import triage_system_prompt, triage_user_prompt, profile, prompt_instructions
+from .triage_rules import fast_classify, keyword_model, email_text
+
+load_dotenv()
+
+# Emails classified by the LLM at the same time in one batch
+TRIAGE_CONCURRENCY = int(os.getenv("TRIAGE_CONCURRENCY", "16"))
+
+
+class Router(BaseModel):
+    """Analyze the unread email and route it according to its content."""
+
+    reasoning: str = Field(
+        description="Step-by-step reasoning behind the classification."
+    )
+    classification: Literal["ignore", "respond", "notify"] = Field(
+        description="The classification of an email: 'ignore' for irrelevant emails, "
+                    "'notify' for important information that doesn't need a response, "
+                    "'respond' for emails that need a reply",
+    )
+
+
+# Triage - Define Prompt
+# The email is in the last message, after the system prompt shared by all emails.
+def create_triage_prompt(email: dict):
+    return [
+        {
+            "role": "system",
+            "content": triage_system_prompt.format(
+                full_name=profile["full_name"],
+                name=profile["name"],
+                user_profile_background=profile["user_profile_background"],
+                triage_no=prompt_instructions["triage_rules"]["ignore"],
+                triage_notify=prompt_instructions["triage_rules"]["notify"],
+                triage_email=prompt_instructions["triage_rules"]["respond"],
+                examples=None
+            )
+        },
+        {
+            "role": "user",
+            "content": triage_user_prompt.format(
+                author=email["from"],
+                to=email["to"],
+                subject=email["subject"],
+                email_thread=email["body"]
+            )
+        }
+    ]
+
+
+def email_hash(email: dict) -> str:
+    """Hash of the normalized email thread. Emails differing only in case or whitespace share it."""
+    normalized = "\n".join(" ".join(str(email.get(key) or "").split()).lower()
+                           for key in ("from", "to", "subject", "body"))
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+async def triage_email(email: dict) -> Router:
+    # Resolved on every call, the clients are closed and recreated with the app lifespan
+    llm_router = get_chat_model("gpt-4o-mini", structured_output=Router)
+    return await llm_router.ainvoke(create_triage_prompt(email))
+
+
+async def triage_batch(emails: list[dict], concurrency: int = TRIAGE_CONCURRENCY) -> AsyncGenerator[dict, None]:
+    """Classify the emails concurrently and yield results as they finish.
+
+    Obvious ignore and notify emails are classified by local rules (source "rules") and returned first.
+    Emails with the same content hash are classified once. Every result contains the index of the
+    email in the batch, so the caller can match results that arrive out of order.
+    """
+    indexes_by_hash: dict[str, list[int]] = {}
+    for index, email in enumerate(emails):
+        indexes_by_hash.setdefault(email_hash(email), []).append(index)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def classify(content_hash: str, email: dict):
+        async with semaphore:
+            try:
+                router = await triage_email(email)
+            except Exception as e:
+                return content_hash, None, e
+        # LLM results train the local keyword model
+        keyword_model.learn(email_text(email), router.classification)
+        return content_hash, router, None
+
+    tasks = []
+    try:
+        for content_hash, indexes in indexes_by_hash.items():
+            email = emails[indexes[0]]
+            fast_result = fast_classify(email)
+            if fast_result is None:
+                tasks.append(asyncio.create_task(classify(content_hash, email)))
+                continue
+            classification, confidence, reason = fast_result
+            for index in indexes:
+                yield {"index": index, "hash": content_hash, "classification": classification,
+                       "reasoning": reason, "confidence": confidence, "source": "rules"}
+
+        for next_result in asyncio.as_completed(tasks):
+            content_hash, router, error = await next_result
+            for index in indexes_by_hash[content_hash]:
+                if error is not None:
+                    yield {"index": index, "hash": content_hash, "error": str(error)}
+                else:
+                    yield {"index": index, "hash": content_hash, "classification": router.classification,
+                           "reasoning": router.reasoning, "source": "llm"}
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,184 @@
+import math
+import os
+import re
+from collections import Counter
+from dotenv import load_dotenv
+from .prompts import prompt_instructions
+
+load_dotenv()
+
+# Emails classified locally with at least this confidence skip the LLM
+TRIAGE_FAST_PATH_CONFIDENCE = float(os.getenv("TRIAGE_FAST_PATH_CONFIDENCE", "0.9"))
+# Keyword model is used only after it has learned from this many labeled emails
+TRIAGE_MODEL_MIN_EXAMPLES = int(os.getenv("TRIAGE_MODEL_MIN_EXAMPLES", "200"))
+# Words kept by the keyword model. When there are more, the rarest are dropped down to 3/4 of this.
+TRIAGE_MODEL_MAX_WORDS = int(os.getenv("TRIAGE_MODEL_MAX_WORDS", "50000"))
+
+# (classification, confidence, pattern matched against the sender, pattern matched against the subject)
+# Only ignore and notify are decided locally. Anything that may need a response goes to the LLM.
+# Sender patterns match the whole local part of the address ("ci@" but not "marci@").
+sender_subject_rules = [
+    ("ignore", 0.95, r"(?:^|[<\s\"])(newsletter|news|marketing|promo|offers|deals|digest)@", None),
+    ("ignore", 0.9, None, r"\b(newsletter|webinar|% off|sale|deal of the|special offer|weekly digest)\b"),
+    ("notify", 0.95, r"(?:^|[<\s\"])(jenkins|ci|builds?|github-actions|gitlab|circleci|buildkite)@", None),
+    ("notify", 0.9, None, r"\b(build (failed|succeeded|passed|fixed|broken)|pipeline (failed|succeeded|passed)|deployment (succeeded|failed))\b"),
+    ("notify", 0.9, None, r"\b(out sick|sick leave|ooo|out of office)\b"),
+    ("notify", 0.85, None, r"\b(status update|weekly update|project update)\b"),
+]
+compiled_rules = [
+    (classification, confidence,
+     re.compile(sender, re.IGNORECASE) if sender else None,
+     re.compile(subject, re.IGNORECASE) if subject else None)
+    for classification, confidence, sender, subject in sender_subject_rules
+]
+
+# Senders that never expect a reply
+no_reply_sender = re.compile(r"(?:^|[<\s\"])(no-?reply|do-?not-?reply|notifications?)@", re.IGNORECASE)
+# Direct questions and requests are left to the LLM even if a rule matches
+needs_attention = re.compile(r"\?|\b(urgent|asap|can you|could you|please review|meeting)\b", re.IGNORECASE)
+
+word = re.compile(r"[a-z][a-z0-9']+")
+
+
+def tokenize(text: str) -> list[str]:
+    return word.findall(text.lower())
+
+
+def email_text(email: dict) -> str:
+    return f"{email.get('from') or ''} {email.get('subject') or ''} {email.get('body') or ''}"
+
+
+class KeywordModel:
+    """Multinomial naive Bayes over email words. Learns from LLM results, so the fast path grows over time.
+
+    Naive Bayes posteriors are close to 1 for almost every email, so they can't be compared with the
+    fast path threshold. The confidence of a prediction is the precision of the model for the
+    predicted class, measured by predicting every LLM-labeled email before learning it.
+    """
+
+    def __init__(self, max_words: int = TRIAGE_MODEL_MAX_WORDS):
+        self.max_words = max_words
+        self.pruned = 0
+        self.word_counts: dict[str, Counter] = {}
+        self.total_words: Counter = Counter()
+        self.examples: Counter = Counter()
+        self.vocabulary: set[str] = set()
+        # Predictions checked against the LLM label, per predicted class
+        self.predicted: Counter = Counter()
+        self.correct: Counter = Counter()
+
+    def precision(self, classification: str) -> float:
+        """Share of correct predictions of the class, smoothed so that few checks give low confidence."""
+        return (self.correct[classification] + 1) / (self.predicted[classification] + 2)
+
+    def learn(self, text: str, classification: str, check: bool = True):
+        if check and self.size >= TRIAGE_MODEL_MIN_EXAMPLES:
+            prediction = self.posterior(text)
+            self.predicted[prediction[0]] += 1
+            self.correct[prediction[0]] += prediction[0] == classification
+        words = tokenize(text)
+        self.word_counts.setdefault(classification, Counter()).update(words)
+        self.total_words[classification] += len(words)
+        self.examples[classification] += 1
+        self.vocabulary.update(words)
+        if len(self.vocabulary) > self.max_words:
+            self.prune()
+
+    def prune(self):
+        """Drop the rarest words, so emails with random tokens can't grow the model without limit."""
+        totals = Counter()
+        for counts in self.word_counts.values():
+            totals.update(counts)
+        keep = {w for w, _ in totals.most_common(self.max_words * 3 // 4)}
+        for classification, counts in self.word_counts.items():
+            for w in [w for w in counts if w not in keep]:
+                self.total_words[classification] -= counts.pop(w)
+        self.pruned += len(self.vocabulary) - len(keep)
+        self.vocabulary = keep
+
+    def train(self, samples: list[tuple[str, str]]):
+        for text, classification in samples:
+            self.learn(text, classification, check=False)
+
+    @property
+    def size(self) -> int:
+        return sum(self.examples.values())
+
+    def posterior(self, text: str) -> tuple[str, float]:
+        """(classification, naive Bayes posterior probability). The model must have learned something."""
+        words = tokenize(text)
+        vocabulary_size = len(self.vocabulary) + 1
+        log_probabilities = {}
+        for classification, count in self.examples.items():
+            log_probability = math.log(count / self.size)
+            counts = self.word_counts[classification]
+            denominator = self.total_words[classification] + vocabulary_size
+            for w in words:
+                log_probability += math.log((counts[w] + 1) / denominator)
+            log_probabilities[classification] = log_probability
+
+        best = max(log_probabilities, key=log_probabilities.get)
+        normalizer = sum(math.exp(x - log_probabilities[best]) for x in log_probabilities.values())
+        return best, 1 / normalizer
+
+    def predict(self, text: str) -> tuple[str, float] | None:
+        """Return (classification, confidence) or None if the model hasn't learned anything.
+        The confidence is the measured precision of the class, capped by the posterior."""
+        if not self.examples:
+            return None
+        classification, probability = self.posterior(text)
+        return classification, min(probability, self.precision(classification))
+
+
+keyword_model = KeywordModel()
+# Seed the model with the configured triage rules
+keyword_model.train([(text, classification) for classification, text in prompt_instructions["triage_rules"].items()])
+
+fast_path_hits = 0
+fast_path_misses = 0
+
+
+def preclassify(email: dict) -> tuple[str, float, str] | None:
+    """Classify obvious ignore and notify emails without the LLM.
+
+    Returns (classification, confidence, reason) or None if the email has to be classified by the LLM.
+    """
+    sender = email.get("from") or ""
+    subject = email.get("subject") or ""
+    headers = {key.lower(): value for key, value in (email.get("headers") or {}).items()}
+
+    if needs_attention.search(subject):
+        return None
+
+    for classification, confidence, sender_pattern, subject_pattern in compiled_rules:
+        if (sender_pattern and sender_pattern.search(sender)) or (subject_pattern and subject_pattern.search(subject)):
+            return classification, confidence, "sender or subject rule"
+
+    if "list-unsubscribe" in headers or "list-id" in headers:
+        confidence = 0.95 if no_reply_sender.search(sender) else 0.9
+        return "ignore", confidence, "mailing list header"
+
+    if keyword_model.size >= TRIAGE_MODEL_MIN_EXAMPLES:
+        prediction = keyword_model.predict(email_text(email))
+        if prediction and prediction[0] != "respond":
+            return prediction[0], prediction[1], "keyword model"
+
+    return None
+
+
+def fast_classify(email: dict, min_confidence: float = TRIAGE_FAST_PATH_CONFIDENCE) -> tuple[str, float, str] | None:
+    """preclassify() result if it is confident enough to skip the LLM."""
+    global fast_path_hits, fast_path_misses
+    result = preclassify(email)
+    if result is not None and result[1] >= min_confidence:
+        fast_path_hits += 1
+        return result
+    fast_path_misses += 1
+    return None
+
+
+def stats() -> dict:
+    return {"fast_path_hits": fast_path_hits, "llm_calls": fast_path_misses, "model_examples": keyword_model.size,
+            "model_words": len(keyword_model.vocabulary), "model_pruned_words": keyword_model.pruned,
+            "model_precision": {classification: round(keyword_model.precision(classification), 3)
+                                for classification in keyword_model.predicted}}
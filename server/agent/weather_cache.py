@@ -0,0 +1,118 @@
+import os
+from typing import Awaitable, Callable
+import psycopg
+from dotenv import load_dotenv
+from psycopg_pool import AsyncConnectionPool
+from .cache import LRUCache
+from . import openweather
+
+load_dotenv()
+
+# Location -> coordinates. Coordinates don't change, so there is no expiry.
+GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", "10000"))
+# Coordinates -> current weather
+WEATHER_CACHE_SIZE = int(os.getenv("WEATHER_CACHE_SIZE", "1000"))
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", "300"))
+
+# Set by setup(). Without a pool only the in-process caches are used.
+pool: AsyncConnectionPool | None = None
+
+geocode_cache = LRUCache(GEOCODE_CACHE_SIZE)
+weather_cache = LRUCache(WEATHER_CACHE_SIZE, ttl=WEATHER_CACHE_TTL)
+geocode_db_hits = 0
+geocode_db_misses = 0
+
+
+async def setup(db_pool: AsyncConnectionPool):
+    """Create the geocode table and use it as the second level of the geocode cache."""
+    global pool
+    async with db_pool.connection() as conn:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS weather_geocode (
+                location TEXT PRIMARY KEY,
+                latitude TEXT NOT NULL,
+                longitude TEXT NOT NULL,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """)
+    pool = db_pool
+
+
+def parse_coordinates(latitude, longitude) -> tuple[float, float]:
+    """Coordinates as floats. Raises ValueError if they aren't numbers or are out of range,
+    e.g. when the geocoding LLM answers "N/A"."""
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except TypeError:
+        raise ValueError(f"Invalid coordinates: {latitude}, {longitude}")
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError(f"Coordinates out of range: {latitude}, {longitude}")
+    return latitude, longitude
+
+
+def normalize_location(location: str) -> str:
+    return " ".join(location.lower().split()).strip(" ,.")
+
+
+async def get_coordinates(location: str, geocode: Callable[[str], Awaitable[tuple[str, str]]]) -> tuple[float, float]:
+    """Return (latitude, longitude) of the location. geocode is called only if the location isn't cached.
+    Only valid coordinates are cached, invalid ones raise ValueError."""
+    global geocode_db_hits, geocode_db_misses
+    key = normalize_location(location)
+
+    coordinates = geocode_cache.get(key)
+    if coordinates is not None:
+        return coordinates
+
+    if pool is not None:
+        try:
+            async with pool.connection() as conn:
+                cursor = await conn.execute(
+                    "SELECT latitude, longitude FROM weather_geocode WHERE location = %s", (key,))
+                row = await cursor.fetchone()
+            if row:
+                try:
+                    coordinates = parse_coordinates(row["latitude"], row["longitude"])
+                except ValueError:
+                    # Stored before the coordinates were validated. Geocoded again below.
+                    async with pool.connection() as conn:
+                        await conn.execute("DELETE FROM weather_geocode WHERE location = %s", (key,))
+                else:
+                    geocode_db_hits += 1
+                    geocode_cache.set(key, coordinates)
+                    return coordinates
+            geocode_db_misses += 1
+        except psycopg.Error as e:
+            print(f"Error reading geocode cache: {str(e)}")
+
+    coordinates = parse_coordinates(*await geocode(location))
+    geocode_cache.set(key, coordinates)
+
+    if pool is not None:
+        try:
+            async with pool.connection() as conn:
+                await conn.execute(
+                    "INSERT INTO weather_geocode (location, latitude, longitude) VALUES (%s, %s, %s) "
+                    "ON CONFLICT (location) DO NOTHING",
+                    (key, str(coordinates[0]), str(coordinates[1])))
+        except psycopg.Error as e:
+            print(f"Error writing geocode cache: {str(e)}")
+
+    return coordinates
+
+
+async def get_current_weather(latitude, longitude) -> dict:
+    """Cached openweather.get_current_weather. Nearby coordinates (~1 km) share the entry."""
+    key = (round(float(latitude), 2), round(float(longitude), 2))
+    data = weather_cache.get(key)
+    if data is None:
+        data = await openweather.get_current_weather(latitude, longitude)
+        weather_cache.set(key, data)
+    return data
+
+
+def stats() -> dict:
+    return {
+        "geocode": {**geocode_cache.stats(), "db_hits": geocode_db_hits, "db_misses": geocode_db_misses},
+        "weather": weather_cache.stats(),
+    }
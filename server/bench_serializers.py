@@ -0,0 +1,92 @@
+"""Micro-benchmark of the checkpoint event encoding.
+
+Compares the previous encoding (copying every message into a dict, then stdlib json)
+with the serializers in serializers.py on checkpoints of a growing conversation.
+
+Run from the server directory: python bench_serializers.py
+"""
+import json
+import timeit
+import uuid
+from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
+import serializers
+from utils import checkpoint_event
+
+TURNS = [5, 25, 100]
+REPEAT = 200
+
+
+def build_messages(turns: int):
+    messages = []
+    for i in range(turns):
+        tool_call_id = f"call_{uuid.uuid4().hex[:24]}"
+        messages.append(HumanMessage(content=f"What's the weather in city number {i}? Also remind me to buy milk.", id=str(uuid.uuid4())))
+        messages.append(AIMessage(content="", id=f"run-{uuid.uuid4()}", tool_calls=[
+            {"name": "weather_tool", "args": {"query": f"City {i}"}, "id": tool_call_id, "type": "tool_call"}]))
+        messages.append(ToolMessage(content="Clouds", tool_call_id=tool_call_id, id=str(uuid.uuid4())))
+        messages.append(AIMessage(content=f"The weather in city number {i} is cloudy with a light breeze. " * 4, id=f"run-{uuid.uuid4()}"))
+    return messages
+
+
+def build_checkpoint(turns: int):
+    """Checkpoint as emitted by graph.astream in debug stream mode."""
+    messages = build_messages(turns)
+    return {
+        "type": "checkpoint",
+        "payload": {
+            "next": ["chatbot"],
+            "values": {
+                "messages": messages,
+                "weather_forecast": [{"location": f"City {i}", "search_status": "", "result": "Clouds"} for i in range(turns)]
+            },
+            "config": {"configurable": {"checkpoint_id": str(uuid.uuid4()), "checkpoint_ns": "", "thread_id": str(uuid.uuid4())}},
+            "metadata": {"source": "loop", "step": turns * 3, "writes": {"weather": {"messages": messages[-2:]}}, "parents": {}}
+        }
+    }
+
+
+def legacy_checkpoint_event(value):
+    """Encoding used before serializers.py was introduced."""
+
+    def format_values(values: dict):
+        formatted_values = values.copy()
+        if "messages" in formatted_values:
+            formatted_values["messages"] = [
+                {
+                    "type": msg.get("type") if isinstance(msg, dict) else msg.type,
+                    "content": msg.get("content") if isinstance(msg, dict) else msg.content,
+                    "id": msg.get("id") if isinstance(msg, dict) else msg.id,
+                    "tool_calls": msg.get("tool_calls") if isinstance(msg, dict) else (msg.tool_calls if hasattr(msg, 'tool_calls') else None)
+                }
+                for msg in formatted_values["messages"]
+            ]
+        return formatted_values
+
+    payload = value["payload"]
+    data = {
+        "next": payload["next"],
+        "values": format_values(payload["values"]),
+        "config": payload["config"],
+        "metadata": {**payload["metadata"], "writes": {k: format_values(v) for k, v in payload["metadata"]["writes"].items()}}
+    }
+    return {"event": "checkpoint", "data": json.dumps(data)}
+
+
+def main():
+    print(f"{'turns':>6} {'encoder':>10} {'us/event':>10} {'bytes':>8}")
+    for turns in TURNS:
+        checkpoint = build_checkpoint(turns)
+
+        seconds = timeit.timeit(lambda: legacy_checkpoint_event(checkpoint), number=REPEAT)
+        size = len(legacy_checkpoint_event(checkpoint)["data"])
+        print(f"{turns:>6} {'legacy':>10} {seconds / REPEAT * 1e6:>10.1f} {size:>8}")
+
+        for name in serializers.available_serializers:
+            serializers.set_serializer(name)
+            seconds = timeit.timeit(lambda: checkpoint_event(checkpoint), number=REPEAT)
+            size = len(checkpoint_event(checkpoint)["data"])
+            print(f"{turns:>6} {name:>10} {seconds / REPEAT * 1e6:>10.1f} {size:>8}")
+
+
+if __name__ == "__main__":
+    main()
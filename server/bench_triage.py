@@ -0,0 +1,78 @@
+"""Benchmark of the local triage fast path.
+
+Reports how many emails of a labeled sample are classified without the LLM and how often
+the fast path agrees with the label. With --llm the emails are also classified by the LLM
+(needs OPENAI_API_KEY) and the agreement of the fast path with the LLM is reported.
+
+Run from the server directory: python bench_triage.py [--llm] [--file labeled.jsonl]
+The optional file contains one {"email": {...}, "label": "..."} object per line.
+"""
+import argparse
+import asyncio
+import json
+import time
+from agent.triage_rules import fast_classify
+from agent.triage import triage_email
+
+
+def email(sender, subject, body, headers=None):
+    return {"from": sender, "to": "John Doe <john.doe@company.com>", "subject": subject, "body": body,
+            "headers": headers or {}}
+
+
+sample = [
+    (email("Acme Deals <deals@acme.com>", "Special offer: 30% off this weekend", "Don't miss our sale."), "ignore"),
+    (email("Tech Weekly <newsletter@techweekly.io>", "This week in AI", "Top stories of the week.",
+           {"List-Unsubscribe": "<mailto:unsub@techweekly.io>"}), "ignore"),
+    (email("Webinars <events@cloudco.com>", "Join our webinar on Kubernetes", "Register now."), "ignore"),
+    (email("HR <hr@company.com>", "Company picnic announcement", "All employees are invited to the picnic.",
+           {"List-Id": "all-company.company.com"}), "ignore"),
+    (email("Marketing <marketing@saas.com>", "Product news", "Check out our new features.",
+           {"List-Unsubscribe": "<https://saas.com/unsub>"}), "ignore"),
+    (email("Jenkins <jenkins@company.com>", "Build failed: api-service #1432", "Tests failed on main."), "notify"),
+    (email("GitHub <notifications@github.com>", "Pipeline succeeded for web-app", "All checks passed."), "notify"),
+    (email("Bob <bob@company.com>", "Out sick today", "I'm out sick today, back tomorrow."), "notify"),
+    (email("PM <pm@company.com>", "Weekly update: auth project", "We finished the token refresh work."), "notify"),
+    (email("CircleCI <builds@circleci.com>", "Deployment succeeded: prod", "Version 2.3.1 is live."), "notify"),
+    (email("Alice <alice.smith@company.com>", "Quick question about API documentation",
+           "Could you help clarify if the missing endpoints were intentional?"), "respond"),
+    (email("Carol <carol@company.com>", "Meeting request: design review", "Can we meet on Thursday?"), "respond"),
+    (email("Dave <dave@company.com>", "URGENT: production is down", "Critical bug in payments, please look."), "respond"),
+    (email("Eve <eve@company.com>", "Code review", "Please review my PR when you have time."), "respond"),
+    (email("Frank <frank@partner.com>", "Contract", "Could you send the signed contract?"), "respond"),
+]
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--llm", action="store_true", help="compare the fast path with the LLM")
+    parser.add_argument("--file", help="JSONL file with labeled emails")
+    args = parser.parse_args()
+
+    samples = sample
+    if args.file:
+        with open(args.file) as f:
+            samples = [(x["email"], x["label"]) for x in map(json.loads, f) if x]
+
+    started = time.perf_counter()
+    fast_results = [fast_classify(email) for email, _ in samples]
+    elapsed = time.perf_counter() - started
+
+    fast = [(result, label) for result, (_, label) in zip(fast_results, samples) if result]
+    agree_label = sum(result[0] == label for result, label in fast)
+    print(f"emails:                {len(samples)}")
+    print(f"fast path:             {len(fast)} ({len(fast) / len(samples):.0%} of LLM calls saved)")
+    print(f"fast path agrees with label: {agree_label}/{len(fast)}")
+    print(f"fast path time:        {elapsed / len(samples) * 1e6:.0f} us/email")
+
+    if args.llm:
+        llm_results = await asyncio.gather(*(triage_email(email) for email, _ in samples))
+        agree_llm = sum(result[0] == router.classification
+                        for result, router in zip(fast_results, llm_results) if result)
+        agree_llm_label = sum(router.classification == label for router, (_, label) in zip(llm_results, samples))
+        print(f"fast path agrees with LLM:   {agree_llm}/{len(fast)}")
+        print(f"LLM agrees with label:       {agree_llm_label}/{len(samples)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+"""Event loop lag of the weather requests under concurrent runs.
+
+Starts a local stand-in for the OpenWeather API that answers after a delay and calls it
+concurrently with the blocking requests.get (used by the weather node before) and with
+agent.openweather. A ticker task measures how late the event loop wakes it up.
+
+Run from the server directory: python bench_weather.py
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+PORT = 8765
+DELAY = 0.2
+CONCURRENCY = 20
+TICK = 0.01
+
+os.environ["OPENWEATHER_URL"] = f"http://127.0.0.1:{PORT}/data/2.5/weather"
+from agent import openweather  # noqa: E402  (reads OPENWEATHER_URL on import)
+
+
+class WeatherHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(DELAY)
+        body = json.dumps({"weather": [{"main": "Clouds"}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+async def measure_lag(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        started = time.monotonic()
+        await asyncio.sleep(TICK)
+        lags.append(time.monotonic() - started - TICK)
+
+
+async def blocking_weather():
+    response = requests.get(os.environ["OPENWEATHER_URL"], params={"lat": 0, "lon": 0})
+    return response.json()
+
+
+async def run(name, call):
+    stop = asyncio.Event()
+    lags = []
+    ticker = asyncio.create_task(measure_lag(stop, lags))
+    started = time.monotonic()
+    await asyncio.gather(*(call() for _ in range(CONCURRENCY)))
+    elapsed = time.monotonic() - started
+    stop.set()
+    await ticker
+    print(f"{name:>12}: total {elapsed * 1000:7.0f} ms, max loop lag {max(lags) * 1000:7.1f} ms")
+
+
+async def main():
+    server = ThreadingHTTPServer(("127.0.0.1", PORT), WeatherHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        print(f"{CONCURRENCY} concurrent weather calls, {DELAY * 1000:.0f} ms response time")
+        await run("requests", blocking_weather)
+        await run("openweather", lambda: openweather.get_current_weather(0, 0))
+    finally:
+        await openweather.close()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,50 @@
+"""Forks and the branch tree of a thread.
+
+A fork is a new checkpoint whose parent is the forked checkpoint. Channels are versioned, so the
+fork only stores the channels it changes and shares the rest with its parent. fork_override()
+keeps the override that small: values equal to the parent's are dropped, and for message lists
+only the new or edited messages are kept (add_messages merges them by id). Messages sent back
+unchanged by the client keep the stored version, with all its metadata.
+
+The branch tree is read from the checkpoints table without loading any channel values.
+"""
+from langchain_core.messages import convert_to_messages
+from psycopg_pool import AsyncConnectionPool
+from serializers import encode_message, is_message_list
+
+BRANCH_TREE_QUERY = """
+    SELECT checkpoint_id, parent_checkpoint_id, checkpoint ->> 'ts' AS ts,
+           (metadata ->> 'step')::int AS step, metadata ->> 'source' AS source
+    FROM checkpoints WHERE thread_id = %s AND checkpoint_ns = ''
+    ORDER BY checkpoint_id
+"""
+
+
+def fork_override(parent_values: dict, override: dict) -> dict:
+    """Part of the override that differs from the state of the forked checkpoint."""
+    changed = {}
+    for key, value in override.items():
+        parent_value = parent_values.get(key)
+        if isinstance(value, list) and parent_value and is_message_list(parent_value):
+            # Messages are compared on the fields the client receives: type, content and tool calls with their args
+            parent_messages = {msg.id: encode_message(msg) for msg in parent_value if msg.id}
+            value = [msg for msg in convert_to_messages(value)
+                     if not msg.id or parent_messages.get(msg.id) != encode_message(msg)]
+            if value:
+                changed[key] = value
+        elif value != parent_value:
+            changed[key] = value
+    return changed
+
+
+async def branch_tree(pool: AsyncConnectionPool, thread_id: str) -> list[dict]:
+    """Checkpoints of the thread (root graph only), oldest first, with their parent ids.
+    Forks are the checkpoints with more than one child."""
+    async with pool.connection() as conn:
+        cursor = await conn.execute(BRANCH_TREE_QUERY, (thread_id,))
+        rows = await cursor.fetchall()
+    children: dict[str, int] = {}
+    for row in rows:
+        if row["parent_checkpoint_id"]:
+            children[row["parent_checkpoint_id"]] = children.get(row["parent_checkpoint_id"], 0) + 1
+    return [{**row, "children": children.get(row["checkpoint_id"], 0)} for row in rows]
@@ -0,0 +1,299 @@
+"""Compact checkpoint storage: content-addressed messages and compressed blobs.
+
+Every checkpoint stores the full value of the channels that changed, so a thread with N messages
+writes the message list N times. CompactSerializer stores a list of messages as the hashes of its
+messages instead. CompactPostgresSaver writes each message once per thread to checkpoint_messages
+before the checkpoint that references it, and resolves the hashes when checkpoints are read.
+Other blobs larger than CHECKPOINT_COMPRESS_MIN_BYTES are compressed with zstd (or zlib if
+zstandard isn't installed).
+
+Checkpoints written by the default serializer are still read, see migrate_checkpoints.py to convert them.
+"""
+import hashlib
+import json
+import os
+import zlib
+from typing import Any, AsyncIterator, Sequence
+from dotenv import load_dotenv
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from agent.cache import LRUCache
+from serializers import is_message_list
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+load_dotenv()
+
+# Checkpoint serializer: "default" (LangGraph's serializer) or "compact"
+CHECKPOINT_SERDE = os.getenv("CHECKPOINT_SERDE", "default")
+# Compression of large blobs: "zstd", "zlib" or "none". Defaults to zstd if it's installed.
+CHECKPOINT_COMPRESSION = os.getenv("CHECKPOINT_COMPRESSION", "zstd" if zstandard else "zlib")
+CHECKPOINT_COMPRESS_MIN_BYTES = int(os.getenv("CHECKPOINT_COMPRESS_MIN_BYTES", "1024"))
+# Encoded messages kept in memory, so writing and reading recent checkpoints doesn't hit the table
+CHECKPOINT_MESSAGE_CACHE_SIZE = int(os.getenv("CHECKPOINT_MESSAGE_CACHE_SIZE", "10000"))
+
+MESSAGE_REFS_TYPE = "msgrefs"
+# Seconds a worker assumes a message it wrote is still in checkpoint_messages. Compaction deletes
+# unreferenced messages only of threads idle for longer (see compaction.py).
+SAVED_MESSAGES_TTL = 3600
+
+CREATE_MESSAGES_TABLE = """
+    CREATE TABLE IF NOT EXISTS checkpoint_messages (
+        thread_id TEXT NOT NULL,
+        hash TEXT NOT NULL,
+        type TEXT NOT NULL,
+        data BYTEA NOT NULL,
+        PRIMARY KEY (thread_id, hash)
+    )
+"""
+
+
+def compress(type_: str, data: bytes, method: str = CHECKPOINT_COMPRESSION,
+             min_bytes: int = CHECKPOINT_COMPRESS_MIN_BYTES) -> tuple[str, bytes]:
+    """The compression method is prefixed to the type. Data that doesn't shrink is stored as it is."""
+    if method == "none" or data is None or len(data) < min_bytes:
+        return type_, data
+    if method == "zstd" and zstandard is None:
+        method = "zlib"
+    if method == "zstd":
+        compressed = zstandard.ZstdCompressor(level=3).compress(data)
+    else:
+        compressed = zlib.compress(data, 6)
+    if len(compressed) >= len(data):
+        return type_, data
+    return f"{method}+{type_}", compressed
+
+
+def decompress(type_: str, data: bytes) -> tuple[str, bytes]:
+    method, _, inner_type = type_.partition("+")
+    if method == "zstd":
+        if zstandard is None:
+            raise ValueError("Checkpoint is compressed with zstd, install zstandard to read it")
+        return inner_type, zstandard.ZstdDecompressor().decompress(data)
+    if method == "zlib":
+        return inner_type, zlib.decompress(data)
+    return type_, data
+
+
+class MessageRefs:
+    """Message list whose messages weren't in memory when the blob was loaded.
+    Replaced by the messages by CompactPostgresSaver.resolve()."""
+
+    def __init__(self, hashes: list[str]):
+        self.hashes = hashes
+
+
+class CompactSerializer:
+    """Serializer storing message lists as message hashes and compressing large blobs.
+
+    The encoded messages are kept in memory by hash. Messages missing from memory when a
+    blob is loaded are returned as MessageRefs, to be read from checkpoint_messages.
+    """
+
+    def __init__(self, serde: JsonPlusSerializer | None = None, cache_size: int = CHECKPOINT_MESSAGE_CACHE_SIZE):
+        self.serde = serde or JsonPlusSerializer()
+        # hash -> (type, data) of the encoded message
+        self.messages = LRUCache(cache_size)
+        self.encoded = 0
+        self.compressed = 0
+
+    def dumps(self, obj: Any) -> bytes:
+        return self.serde.dumps(obj)
+
+    def loads(self, data: bytes) -> Any:
+        return self.serde.loads(data)
+
+    def encode_message(self, msg: BaseMessage) -> tuple[str, tuple[str, bytes]]:
+        """(hash, (type, data)) of the message. The hash is computed from the serialized message,
+        so any change of a message (tool call args, metadata) gets a new hash."""
+        type_, data = self.serde.dumps_typed(msg)
+        hash_ = hashlib.sha256(type_.encode() + b"\0" + data).hexdigest()[:32]
+        row = self.messages.get(hash_)
+        if row is None:
+            row = compress(type_, data)
+            self.messages.set(hash_, row)
+            self.encoded += 1
+        return hash_, row
+
+    def decode_message(self, row: tuple[str, bytes]) -> BaseMessage:
+        return self.serde.loads_typed(decompress(*row))
+
+    def dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        if is_message_list(obj):
+            return MESSAGE_REFS_TYPE, json.dumps([self.encode_message(msg)[0] for msg in obj]).encode()
+        type_, data = self.serde.dumps_typed(obj)
+        compressed = compress(type_, data)
+        if compressed[0] != type_:
+            self.compressed += 1
+        return compressed
+
+    def loads_typed(self, data: tuple[str, bytes]) -> Any:
+        type_, payload = data
+        if type_ != MESSAGE_REFS_TYPE:
+            return self.serde.loads_typed(decompress(type_, payload))
+        hashes = json.loads(payload)
+        rows = [self.messages.get(hash_) for hash_ in hashes]
+        if any(row is None for row in rows):
+            return MessageRefs(hashes)
+        return [self.decode_message(row) for row in rows]
+
+    def stats(self) -> dict:
+        compression = "zlib" if CHECKPOINT_COMPRESSION == "zstd" and zstandard is None else CHECKPOINT_COMPRESSION
+        return {"compression": compression, "messages": self.messages.stats(),
+                "encoded_messages": self.encoded, "compressed_blobs": self.compressed}
+
+
+class CompactPostgresSaver(AsyncPostgresSaver):
+    """AsyncPostgresSaver storing the messages of a thread once in checkpoint_messages.
+
+    Messages are written before the checkpoint or writes that reference them, so a stored
+    checkpoint never points to a missing message. Must be created with a connection pool.
+    """
+
+    def __init__(self, pool, serde: CompactSerializer | None = None):
+        self.compact_serde = serde or CompactSerializer()
+        super().__init__(pool, serde=self.compact_serde)
+        # (thread_id, hash) of the messages known to be in the table. Expires, because compaction
+        # deletes the messages no checkpoint references any more.
+        self.saved = LRUCache(CHECKPOINT_MESSAGE_CACHE_SIZE, ttl=SAVED_MESSAGES_TTL)
+        self.messages_written = 0
+        self.messages_read = 0
+
+    async def setup(self) -> None:
+        await super().setup()
+        async with self.conn.connection() as conn:
+            await conn.execute(CREATE_MESSAGES_TABLE)
+
+    async def store_messages(self, thread_id: str, values) -> None:
+        rows = {}
+        for value in values:
+            if not is_message_list(value):
+                continue
+            for msg in value:
+                hash_, (type_, data) = self.compact_serde.encode_message(msg)
+                # get() checks the expiry, `in` doesn't
+                if self.saved.get((thread_id, hash_)) is None:
+                    rows[hash_] = (thread_id, hash_, type_, data)
+        if not rows:
+            return
+        async with self.conn.connection() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.executemany(
+                    "INSERT INTO checkpoint_messages (thread_id, hash, type, data) VALUES (%s, %s, %s, %s) "
+                    "ON CONFLICT DO NOTHING", list(rows.values()))
+        for hash_ in rows:
+            self.saved.set((thread_id, hash_), True)
+        self.messages_written += len(rows)
+
+    async def resolve(self, checkpoint_tuples: list[CheckpointTuple]) -> list[CheckpointTuple]:
+        """Replace the MessageRefs in the channel values and pending writes by the messages.
+        The missing messages of all tuples are read with one query."""
+        refs = []
+        for checkpoint_tuple in checkpoint_tuples:
+            thread_id = checkpoint_tuple.config["configurable"]["thread_id"]
+            for value in self.tuple_values(checkpoint_tuple):
+                if isinstance(value, MessageRefs):
+                    refs.extend((thread_id, hash_) for hash_ in value.hashes)
+        if not refs:
+            return checkpoint_tuples
+
+        # Rows are collected first, the cache may evict some of them while the messages are decoded
+        rows = {}
+        missing = set()
+        for thread_id, hash_ in refs:
+            row = self.compact_serde.messages.peek(hash_)
+            if row is not None:
+                rows[hash_] = row
+            else:
+                missing.add((thread_id, hash_))
+        if missing:
+            thread_ids, hashes = zip(*missing)
+            async with self.conn.connection() as conn:
+                cursor = await conn.execute(
+                    "SELECT hash, type, data FROM checkpoint_messages "
+                    "WHERE (thread_id, hash) IN (SELECT * FROM unnest(%s::text[], %s::text[]))",
+                    (list(thread_ids), list(hashes)))
+                for row in await cursor.fetchall():
+                    rows[row["hash"]] = (row["type"], bytes(row["data"]))
+                    self.compact_serde.messages.set(row["hash"], rows[row["hash"]])
+                    self.messages_read += 1
+
+        def load(value):
+            if not isinstance(value, MessageRefs):
+                return value
+            if any(hash_ not in rows for hash_ in value.hashes):
+                raise ValueError("Messages of a checkpoint are missing from checkpoint_messages")
+            return [self.compact_serde.decode_message(rows[hash_]) for hash_ in value.hashes]
+
+        return [self.resolve_tuple(checkpoint_tuple, load) for checkpoint_tuple in checkpoint_tuples]
+
+    @staticmethod
+    def tuple_values(checkpoint_tuple: CheckpointTuple) -> list:
+        values = list(checkpoint_tuple.checkpoint["channel_values"].values())
+        values.extend(value for _, _, value in checkpoint_tuple.pending_writes or [])
+        return values
+
+    @staticmethod
+    def resolve_tuple(checkpoint_tuple: CheckpointTuple, load) -> CheckpointTuple:
+        if not any(isinstance(value, MessageRefs) for value in CompactPostgresSaver.tuple_values(checkpoint_tuple)):
+            return checkpoint_tuple
+        checkpoint = {**checkpoint_tuple.checkpoint,
+                      "channel_values": {channel: load(value)
+                                         for channel, value in checkpoint_tuple.checkpoint["channel_values"].items()}}
+        pending_writes = checkpoint_tuple.pending_writes
+        if pending_writes:
+            pending_writes = [(task_id, channel, load(value)) for task_id, channel, value in pending_writes]
+        return checkpoint_tuple._replace(checkpoint=checkpoint, pending_writes=pending_writes)
+
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        checkpoint_tuple = await super().aget_tuple(config)
+        if checkpoint_tuple is None:
+            return None
+        return (await self.resolve([checkpoint_tuple]))[0]
+
+    async def alist(self, config: RunnableConfig | None, *, filter: dict[str, Any] | None = None,
+                    before: RunnableConfig | None = None, limit: int | None = None,
+                    batch_size: int = 50) -> AsyncIterator[CheckpointTuple]:
+        batch = []
+        async for checkpoint_tuple in super().alist(config, filter=filter, before=before, limit=limit):
+            batch.append(checkpoint_tuple)
+            if len(batch) >= batch_size:
+                for resolved in await self.resolve(batch):
+                    yield resolved
+                batch = []
+        for resolved in await self.resolve(batch):
+            yield resolved
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        values = [value for channel, value in checkpoint["channel_values"].items() if channel in new_versions]
+        await self.store_messages(config["configurable"]["thread_id"], values)
+        return await super().aput(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        await self.store_messages(config["configurable"]["thread_id"], [value for _, value in writes])
+        await super().aput_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await super().adelete_thread(thread_id)
+        async with self.conn.connection() as conn:
+            await conn.execute("DELETE FROM checkpoint_messages WHERE thread_id = %s", (thread_id,))
+        for key in [key for key in self.saved.items if key[0] == thread_id]:
+            self.saved.delete(key)
+
+    def stats(self) -> dict:
+        return {**self.compact_serde.stats(), "messages_written": self.messages_written,
+                "messages_read": self.messages_read}
+
+
+def create_saver(pool) -> AsyncPostgresSaver:
+    if CHECKPOINT_SERDE == "compact":
+        return CompactPostgresSaver(pool)
+    return AsyncPostgresSaver(pool)
@@ -0,0 +1,191 @@
+import asyncio
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Sequence
+from dotenv import load_dotenv
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import BaseCheckpointSaver, ChannelVersions, Checkpoint, CheckpointMetadata, \
+    CheckpointTuple
+
+load_dotenv()
+
+# sync: every checkpoint is written before the next step runs.
+# async: checkpoints are written in the background and flushed at the end of the run (also at interrupts).
+# exit: only the last checkpoint of the run is written, when the run ends.
+# Can be overridden per request with the durability field of /agent.
+CHECKPOINT_DURABILITY = os.getenv("CHECKPOINT_DURABILITY", "sync")
+# Checkpoint writes waiting in async mode. Steps wait when the queue is full.
+CHECKPOINT_WRITE_QUEUE_SIZE = int(os.getenv("CHECKPOINT_WRITE_QUEUE_SIZE", "1000"))
+
+DURABILITY_MODES = ("sync", "async", "exit")
+
+# Durability of the run in the current task, set by the caller before the graph runs
+durability = ContextVar("durability", default=CHECKPOINT_DURABILITY)
+
+
+class WriteBehindSaver(BaseCheckpointSaver):
+    """Checkpointer writing checkpoints in the background, wrapping AsyncPostgresSaver.
+
+    Writes are applied by one writer task in the order they were made. A bounded queue keeps
+    memory in check. In exit mode the checkpoints of a thread are merged in memory: the last one
+    is written with the channel versions of all merged steps and the parent of the first one.
+    Every read of a thread first flushes its pending writes, so a resume or /state never sees
+    an older state. Writes that aren't flushed are lost if the process crashes.
+    """
+
+    def __init__(self, saver: BaseCheckpointSaver, queue_size: int = CHECKPOINT_WRITE_QUEUE_SIZE):
+        super().__init__(serde=saver.serde)
+        self.saver = saver
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer: asyncio.Task | None = None
+        # Queued writes per thread and a condition to wait for them
+        self.pending: dict[str, int] = {}
+        self.written = asyncio.Condition()
+        self.errors: dict[str, Exception] = {}
+        # Exit mode: merged checkpoint per thread
+        self.deferred: dict[str, dict] = {}
+        self.writes = 0
+        self.merged = 0
+        self.failed = 0
+        self.flushes = 0
+        self.flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    @property
+    def config_specs(self):
+        return self.saver.config_specs
+
+    def get_next_version(self, current, channel):
+        return self.saver.get_next_version(current, channel)
+
+    def start(self):
+        self.writer = asyncio.create_task(self.write_loop())
+
+    async def close(self):
+        await self.flush()
+        if self.writer is not None:
+            self.writer.cancel()
+            await asyncio.gather(self.writer, return_exceptions=True)
+            self.writer = None
+
+    async def write_loop(self):
+        while True:
+            thread_id, method, args = await self.queue.get()
+            try:
+                await method(*args)
+                self.writes += 1
+            except Exception as e:
+                print(f"Error writing checkpoint of thread {thread_id}: {str(e)}")
+                self.errors[thread_id] = e
+                self.failed += 1
+            async with self.written:
+                self.pending[thread_id] -= 1
+                if not self.pending[thread_id]:
+                    del self.pending[thread_id]
+                self.written.notify_all()
+
+    async def enqueue(self, thread_id: str, method, *args):
+        self.pending[thread_id] = self.pending.get(thread_id, 0) + 1
+        await self.queue.put((thread_id, method, args))
+
+    async def flush(self, thread_id: str | None = None):
+        """Write the deferred checkpoints and wait for the queued writes of the thread (or of all threads).
+        Raises the error of a failed write."""
+        if thread_id is not None and thread_id not in self.pending and thread_id not in self.deferred:
+            if thread_id in self.errors:
+                raise self.errors.pop(thread_id)
+            return
+        started = time.perf_counter()
+        for deferred_thread_id in [thread_id] if thread_id is not None else list(self.deferred):
+            await self.write_deferred(deferred_thread_id)
+        async with self.written:
+            await self.written.wait_for(lambda: not (self.pending.get(thread_id) if thread_id else self.pending))
+        elapsed = time.perf_counter() - started
+        self.flushes += 1
+        self.flush_seconds += elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+        if thread_id is not None and thread_id in self.errors:
+            raise self.errors.pop(thread_id)
+
+    async def write_deferred(self, thread_id: str):
+        deferred = self.deferred.pop(thread_id, None)
+        if deferred is None:
+            return
+        await self.enqueue(thread_id, self.saver.aput, deferred["config"], deferred["checkpoint"],
+                           deferred["metadata"], deferred["new_versions"])
+        for config, writes, task_id, task_path in deferred["writes"].get(deferred["checkpoint"]["id"], []):
+            await self.enqueue(thread_id, self.saver.aput_writes, config, writes, task_id, task_path)
+
+    @staticmethod
+    def thread_id(config: RunnableConfig) -> str | None:
+        return (config or {}).get("configurable", {}).get("thread_id")
+
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        await self.flush(self.thread_id(config))
+        return await self.saver.aget_tuple(config)
+
+    async def alist(self, config: RunnableConfig | None, *, filter: dict[str, Any] | None = None,
+                    before: RunnableConfig | None = None, limit: int | None = None) -> AsyncIterator[CheckpointTuple]:
+        await self.flush(self.thread_id(config))
+        async for checkpoint_tuple in self.saver.alist(config, filter=filter, before=before, limit=limit):
+            yield checkpoint_tuple
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        mode = durability.get()
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        next_config = {"configurable": {"thread_id": thread_id,
+                                        "checkpoint_ns": configurable.get("checkpoint_ns", ""),
+                                        "checkpoint_id": checkpoint["id"]}}
+        # Only root graph checkpoints are merged. Subgraph checkpoints are written in the background.
+        if mode == "exit" and not configurable.get("checkpoint_ns"):
+            deferred = self.deferred.get(thread_id)
+            if deferred is None:
+                self.deferred[thread_id] = {"config": config, "checkpoint": checkpoint, "metadata": metadata,
+                                            "new_versions": dict(new_versions), "writes": {}}
+            else:
+                deferred["checkpoint"] = checkpoint
+                deferred["metadata"] = metadata
+                deferred["new_versions"].update(new_versions)
+                self.merged += 1
+            return next_config
+
+        await self.write_deferred(thread_id)
+        if mode == "sync":
+            await self.flush(thread_id)
+            return await self.saver.aput(config, checkpoint, metadata, new_versions)
+        await self.enqueue(thread_id, self.saver.aput, config, checkpoint, metadata, new_versions)
+        return next_config
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        thread_id = config["configurable"]["thread_id"]
+        deferred = self.deferred.get(thread_id)
+        if deferred is not None and not config["configurable"].get("checkpoint_ns"):
+            checkpoint_id = config["configurable"]["checkpoint_id"]
+            deferred["writes"].setdefault(checkpoint_id, []).append((config, writes, task_id, task_path))
+            return
+        if durability.get() == "sync":
+            await self.flush(thread_id)
+            return await self.saver.aput_writes(config, writes, task_id, task_path)
+        await self.enqueue(thread_id, self.saver.aput_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        self.deferred.pop(thread_id, None)
+        await self.flush(thread_id)
+        await self.saver.adelete_thread(thread_id)
+
+    def stats(self) -> dict:
+        return {
+            "default_mode": CHECKPOINT_DURABILITY,
+            "queue_depth": self.queue.qsize(),
+            "deferred_threads": len(self.deferred),
+            "writes": self.writes,
+            "merged_checkpoints": self.merged,
+            "failed_writes": self.failed,
+            "flushes": self.flushes,
+            "avg_flush_ms": round(self.flush_seconds / self.flushes * 1000, 3) if self.flushes else 0.0,
+            "max_flush_ms": round(self.max_flush_seconds * 1000, 3),
+        }
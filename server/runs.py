@@ -0,0 +1,430 @@
+import asyncio
+import json
+import os
+import socket
+import uuid
+from typing import Callable
+import psycopg
+from dotenv import load_dotenv
+from psycopg_pool import AsyncConnectionPool
+
+load_dotenv()
+
+# local: runs are coordinated inside this process. postgres: shared by all workers through the agent_runs table.
+RUN_COORDINATION = os.getenv("RUN_COORDINATION", "local")
+
+# Runs executed at the same time by this worker, in total and per tenant (x-tenant-id header)
+MAX_ACTIVE_RUNS = int(os.getenv("MAX_ACTIVE_RUNS", "50"))
+MAX_ACTIVE_RUNS_PER_TENANT = int(os.getenv("MAX_ACTIVE_RUNS_PER_TENANT", "20"))
+# Runs waiting for a free slot. Further runs are rejected with 429.
+MAX_QUEUED_RUNS = int(os.getenv("MAX_QUEUED_RUNS", "100"))
+# Seconds a run waits for a free slot or for the previous run of its thread
+RUN_QUEUE_TIMEOUT = float(os.getenv("RUN_QUEUE_TIMEOUT", "10"))
+# Retry-After header of 429 responses
+RUN_RETRY_AFTER = int(os.getenv("RUN_RETRY_AFTER", "2"))
+# Workers refresh the heartbeat of their runs every n seconds. Runs without a heartbeat
+# for RUN_STALE_AFTER seconds (e.g. of a crashed worker) are removed.
+RUN_HEARTBEAT_INTERVAL = float(os.getenv("RUN_HEARTBEAT_INTERVAL", "5"))
+RUN_STALE_AFTER = float(os.getenv("RUN_STALE_AFTER", "30"))
+# Waiting runs retry at least this often, also when a notification is missed
+RUN_POLL_INTERVAL = float(os.getenv("RUN_POLL_INTERVAL", "1"))
+
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}"
+# Notification channel of run events (stop, released)
+RUNS_CHANNEL = "agent_runs"
+# Advisory lock serializing admission of runs of all workers
+RUNS_LOCK_KEY = 7260431
+
+
+class ThreadBusyError(Exception):
+    """Another run of the thread is in progress."""
+
+
+class AdmissionRejectedError(Exception):
+    """No run slot is available."""
+
+    def __init__(self, message: str, retry_after: int = RUN_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RunSlot:
+    """Admission of one run. stop_event is set when the run is stopped. release() can be called any number of times."""
+
+    def __init__(self, manager: "RunManager", thread_id: str, tenant_id: str):
+        self.manager = manager
+        self.thread_id = thread_id
+        self.tenant_id = tenant_id
+        self.run_id = str(uuid.uuid4())
+        self.stop_event = asyncio.Event()
+        self.released = False
+
+    async def release(self):
+        if not self.released:
+            self.released = True
+            await self.manager.release(self)
+
+
+class RunManager:
+    """Serializes runs per thread and limits concurrent runs globally and per tenant.
+
+    A run of a busy thread is rejected, or queued behind the current run if queue is requested.
+    When all slots are taken the run waits in a bounded queue, and is rejected if the queue is full
+    or no slot frees up within the timeout.
+    """
+
+    def __init__(self, max_active: int = MAX_ACTIVE_RUNS, max_active_per_tenant: int = MAX_ACTIVE_RUNS_PER_TENANT,
+                 max_queued: int = MAX_QUEUED_RUNS, queue_timeout: float = RUN_QUEUE_TIMEOUT):
+        self.max_active = max_active
+        self.max_active_per_tenant = max_active_per_tenant
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.condition = asyncio.Condition()
+        self.active = 0
+        self.active_by_tenant: dict[str, int] = {}
+        self.queued = 0
+        self.thread_locks: dict[str, asyncio.Lock] = {}
+        self.thread_waiters: dict[str, int] = {}
+        self.rejected_busy = 0
+        self.rejected_admission = 0
+        # Runs of this process by thread id
+        self.runs: dict[str, RunSlot] = {}
+        # Called with the thread id when a run of another worker is released
+        self.on_released: list[Callable[[str], None]] = []
+
+    def has_slot(self, tenant_id: str) -> bool:
+        return (self.active < self.max_active
+                and self.active_by_tenant.get(tenant_id, 0) < self.max_active_per_tenant)
+
+    def is_running(self, thread_id: str) -> bool:
+        lock = self.thread_locks.get(thread_id)
+        return lock is not None and lock.locked()
+
+    async def acquire(self, thread_id: str, tenant_id: str, queue_if_busy: bool = False) -> RunSlot:
+        await self.acquire_thread(thread_id, queue_if_busy)
+        try:
+            await self.acquire_slot(tenant_id)
+        except BaseException:
+            self.release_thread(thread_id)
+            raise
+        slot = RunSlot(self, thread_id, tenant_id)
+        self.runs[thread_id] = slot
+        return slot
+
+    async def acquire_thread(self, thread_id: str, queue_if_busy: bool):
+        lock = self.thread_locks.setdefault(thread_id, asyncio.Lock())
+        if lock.locked() and not queue_if_busy:
+            self.rejected_busy += 1
+            raise ThreadBusyError(f"Thread {thread_id} is already running")
+
+        self.thread_waiters[thread_id] = self.thread_waiters.get(thread_id, 0) + 1
+        try:
+            await asyncio.wait_for(lock.acquire(), self.queue_timeout)
+        except TimeoutError:
+            self.rejected_busy += 1
+            raise ThreadBusyError(f"Thread {thread_id} is still running")
+        finally:
+            self.thread_waiters[thread_id] -= 1
+            if not lock.locked():
+                self.forget_thread(thread_id)
+
+    async def acquire_slot(self, tenant_id: str):
+        async with self.condition:
+            if not self.has_slot(tenant_id):
+                if self.queued >= self.max_queued:
+                    self.rejected_admission += 1
+                    raise AdmissionRejectedError("Too many runs in progress")
+                self.queued += 1
+                try:
+                    await asyncio.wait_for(self.condition.wait_for(lambda: self.has_slot(tenant_id)), self.queue_timeout)
+                except TimeoutError:
+                    self.rejected_admission += 1
+                    raise AdmissionRejectedError("Too many runs in progress")
+                finally:
+                    self.queued -= 1
+            self.active += 1
+            self.active_by_tenant[tenant_id] = self.active_by_tenant.get(tenant_id, 0) + 1
+
+    async def release(self, slot: RunSlot):
+        self.forget_run(slot)
+        async with self.condition:
+            self.active -= 1
+            self.active_by_tenant[slot.tenant_id] -= 1
+            if self.active_by_tenant[slot.tenant_id] == 0:
+                del self.active_by_tenant[slot.tenant_id]
+            self.condition.notify_all()
+        self.release_thread(slot.thread_id)
+
+    def forget_run(self, slot: RunSlot):
+        if self.runs.get(slot.thread_id) is slot:
+            del self.runs[slot.thread_id]
+
+    def stop_local(self, thread_id: str) -> bool:
+        slot = self.runs.get(thread_id)
+        if slot is None:
+            return False
+        slot.stop_event.set()
+        return True
+
+    async def stop(self, thread_id: str) -> bool:
+        """Stop the run of the thread. Returns False if the thread is not running."""
+        return self.stop_local(thread_id)
+
+    async def status(self, thread_id: str) -> dict | None:
+        """Run of the thread or None if the thread is not running."""
+        slot = self.runs.get(thread_id)
+        if slot is None:
+            return None
+        return {"thread_id": thread_id, "run_id": slot.run_id, "tenant_id": slot.tenant_id, "worker_id": WORKER_ID,
+                "status": "stopping" if slot.stop_event.is_set() else "running"}
+
+    async def setup(self, pool: AsyncConnectionPool, conninfo: str):
+        pass
+
+    async def close(self):
+        pass
+
+    def release_thread(self, thread_id: str):
+        self.thread_locks[thread_id].release()
+        self.forget_thread(thread_id)
+
+    def forget_thread(self, thread_id: str):
+        """Drop the lock of an idle thread, so the dict doesn't grow with every thread ever run."""
+        lock = self.thread_locks.get(thread_id)
+        if lock is not None and not lock.locked() and not self.thread_waiters.get(thread_id):
+            del self.thread_locks[thread_id]
+            self.thread_waiters.pop(thread_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "active_runs": self.active,
+            "active_runs_by_tenant": dict(self.active_by_tenant),
+            "queued_runs": self.queued,
+            "queued_thread_runs": sum(self.thread_waiters.values()),
+            "rejected_busy": self.rejected_busy,
+            "rejected_admission": self.rejected_admission,
+        }
+
+
+class PostgresRunManager(RunManager):
+    """RunManager shared by all workers and nodes through Postgres.
+
+    Every running run has a row in the agent_runs table. Admission checks the thread and the limits
+    against the table under an advisory lock, so the limits hold for the whole deployment.
+    Stop requests and released runs are broadcast with NOTIFY on the agent_runs channel. Each worker
+    listens on its own connection, stops its local run and wakes up its waiting runs.
+    The queue limit (max_queued) applies per worker.
+    """
+
+    def __init__(self, *args, worker_id: str = WORKER_ID, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.worker_id = worker_id
+        self.pool: AsyncConnectionPool | None = None
+        self.conninfo: str | None = None
+        self.tasks: list[asyncio.Task] = []
+        # Incremented on every released run, waiting runs retry when it changes
+        self.release_count = 0
+        self.cluster_active = 0
+
+    async def setup(self, pool: AsyncConnectionPool, conninfo: str):
+        async with pool.connection() as conn:
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS agent_runs (
+                    thread_id TEXT PRIMARY KEY,
+                    run_id TEXT NOT NULL,
+                    tenant_id TEXT NOT NULL,
+                    worker_id TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'running',
+                    started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    heartbeat_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                )
+            """)
+            # Runs of a previous process with the same worker id didn't finish
+            await conn.execute("DELETE FROM agent_runs WHERE worker_id = %s", (self.worker_id,))
+        self.pool = pool
+        self.conninfo = conninfo
+        self.tasks = [asyncio.create_task(self.listen()), asyncio.create_task(self.heartbeat())]
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.pool is not None:
+            try:
+                async with self.pool.connection() as conn:
+                    await conn.execute("DELETE FROM agent_runs WHERE worker_id = %s", (self.worker_id,))
+                    await self.notify(conn, "released")
+            except psycopg.Error as e:
+                print(f"Error releasing runs of worker {self.worker_id}: {str(e)}")
+
+    @staticmethod
+    async def notify(conn, event: str, thread_id: str | None = None):
+        await conn.execute("SELECT pg_notify(%s, %s)", (RUNS_CHANNEL, json.dumps({"event": event, "thread_id": thread_id})))
+
+    async def try_acquire(self, slot: RunSlot) -> str | None:
+        """Insert the run if possible. Returns None on success, "busy" or "full" otherwise."""
+        async with self.pool.connection() as conn:
+            async with conn.transaction():
+                await conn.execute("SELECT pg_advisory_xact_lock(%s)", (RUNS_LOCK_KEY,))
+                await conn.execute("DELETE FROM agent_runs WHERE heartbeat_at < now() - make_interval(secs => %s)",
+                                   (RUN_STALE_AFTER,))
+                cursor = await conn.execute(
+                    "SELECT count(*) AS active, count(*) FILTER (WHERE tenant_id = %s) AS tenant_active, "
+                    "count(*) FILTER (WHERE thread_id = %s) AS thread_active FROM agent_runs",
+                    (slot.tenant_id, slot.thread_id))
+                row = await cursor.fetchone()
+                self.cluster_active = row["active"]
+                if row["thread_active"]:
+                    return "busy"
+                if row["active"] >= self.max_active or row["tenant_active"] >= self.max_active_per_tenant:
+                    return "full"
+                await conn.execute(
+                    "INSERT INTO agent_runs (thread_id, run_id, tenant_id, worker_id) VALUES (%s, %s, %s, %s)",
+                    (slot.thread_id, slot.run_id, slot.tenant_id, self.worker_id))
+                self.cluster_active += 1
+                return None
+
+    async def wait_for_release(self, release_count: int, timeout: float):
+        try:
+            async with self.condition:
+                await asyncio.wait_for(self.condition.wait_for(lambda: self.release_count != release_count), timeout)
+        except TimeoutError:
+            pass
+
+    async def acquire(self, thread_id: str, tenant_id: str, queue_if_busy: bool = False) -> RunSlot:
+        slot = RunSlot(self, thread_id, tenant_id)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.queue_timeout
+        waiting = None
+        try:
+            while True:
+                release_count = self.release_count
+                result = await self.try_acquire(slot)
+                if result is None:
+                    break
+                if result == "busy" and not queue_if_busy:
+                    self.rejected_busy += 1
+                    raise ThreadBusyError(f"Thread {thread_id} is already running")
+                if result == "full" and waiting != "full" and self.queued >= self.max_queued:
+                    self.rejected_admission += 1
+                    raise AdmissionRejectedError("Too many runs in progress")
+
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    if result == "busy":
+                        self.rejected_busy += 1
+                        raise ThreadBusyError(f"Thread {thread_id} is still running")
+                    self.rejected_admission += 1
+                    raise AdmissionRejectedError("Too many runs in progress")
+
+                waiting = self.set_waiting(thread_id, waiting, result)
+                await self.wait_for_release(release_count, min(remaining, RUN_POLL_INTERVAL))
+        finally:
+            self.set_waiting(thread_id, waiting, None)
+
+        self.runs[thread_id] = slot
+        return slot
+
+    def set_waiting(self, thread_id: str, previous: str | None, current: str | None) -> str | None:
+        """Update the queue gauges when a waiting run moves between waiting for its thread and for a slot."""
+        if previous == current:
+            return current
+        if previous == "busy":
+            self.thread_waiters[thread_id] -= 1
+            if not self.thread_waiters[thread_id]:
+                del self.thread_waiters[thread_id]
+        elif previous == "full":
+            self.queued -= 1
+        if current == "busy":
+            self.thread_waiters[thread_id] = self.thread_waiters.get(thread_id, 0) + 1
+        elif current == "full":
+            self.queued += 1
+        return current
+
+    async def release(self, slot: RunSlot):
+        self.forget_run(slot)
+        try:
+            async with self.pool.connection() as conn:
+                await conn.execute("DELETE FROM agent_runs WHERE thread_id = %s AND run_id = %s",
+                                   (slot.thread_id, slot.run_id))
+                await self.notify(conn, "released", slot.thread_id)
+        except psycopg.Error as e:
+            # The row is removed as stale once the heartbeat stops
+            print(f"Error releasing run of thread {slot.thread_id}: {str(e)}")
+
+    async def stop(self, thread_id: str) -> bool:
+        async with self.pool.connection() as conn:
+            cursor = await conn.execute(
+                "UPDATE agent_runs SET status = 'stopping' WHERE thread_id = %s RETURNING worker_id", (thread_id,))
+            row = await cursor.fetchone()
+            if row is None:
+                return False
+            if row["worker_id"] != self.worker_id:
+                await self.notify(conn, "stop", thread_id)
+        self.stop_local(thread_id)
+        return True
+
+    async def status(self, thread_id: str) -> dict | None:
+        async with self.pool.connection() as conn:
+            cursor = await conn.execute(
+                "SELECT thread_id, run_id, tenant_id, worker_id, status, started_at, heartbeat_at "
+                "FROM agent_runs WHERE thread_id = %s", (thread_id,))
+            return await cursor.fetchone()
+
+    async def wake_waiting(self):
+        async with self.condition:
+            self.release_count += 1
+            self.condition.notify_all()
+
+    async def listen(self):
+        """Receive stop and released notifications of all workers. Reconnects if the connection is lost."""
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(self.conninfo, autocommit=True) as conn:
+                    await conn.execute(f"LISTEN {RUNS_CHANNEL}")
+                    async for notification in conn.notifies():
+                        message = json.loads(notification.payload)
+                        if message["event"] == "stop":
+                            self.stop_local(message["thread_id"])
+                        elif message["event"] == "released":
+                            await self.wake_waiting()
+                            if message["thread_id"]:
+                                for callback in self.on_released:
+                                    callback(message["thread_id"])
+            except psycopg.Error as e:
+                print(f"Run notifications connection lost: {str(e)}")
+                await asyncio.sleep(RUN_POLL_INTERVAL)
+
+    async def heartbeat(self):
+        """Keep the runs of this worker alive and pick up stop requests missed while the listener reconnected."""
+        while True:
+            await asyncio.sleep(RUN_HEARTBEAT_INTERVAL)
+            try:
+                async with self.pool.connection() as conn:
+                    cursor = await conn.execute(
+                        "UPDATE agent_runs SET heartbeat_at = now() WHERE worker_id = %s RETURNING thread_id, status",
+                        (self.worker_id,))
+                    for row in await cursor.fetchall():
+                        if row["status"] == "stopping":
+                            self.stop_local(row["thread_id"])
+                    cursor = await conn.execute("SELECT count(*) AS active FROM agent_runs")
+                    self.cluster_active = (await cursor.fetchone())["active"]
+            except psycopg.Error as e:
+                print(f"Error updating run heartbeat: {str(e)}")
+
+    def stats(self) -> dict:
+        active_by_tenant = {}
+        for slot in self.runs.values():
+            active_by_tenant[slot.tenant_id] = active_by_tenant.get(slot.tenant_id, 0) + 1
+        return {
+            **super().stats(),
+            "active_runs": len(self.runs),
+            "active_runs_by_tenant": active_by_tenant,
+            "worker_id": self.worker_id,
+            "cluster_active_runs": self.cluster_active,
+        }
+
+
+def create_run_manager() -> RunManager:
+    return PostgresRunManager() if RUN_COORDINATION == "postgres" else RunManager()
@@ -0,0 +1,65 @@
+import json
+import os
+from langchain_core.messages import BaseMessage
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Serializer used for SSE event data: "orjson" or "json". Defaults to orjson if it's installed.
+SSE_SERIALIZER = os.getenv("SSE_SERIALIZER", "orjson" if orjson else "json")
+
+
+def encode_message(msg: BaseMessage):
+    """Encode only the message fields used by the client.
+    Called by the encoder for every LangChain message, so events can contain message objects directly.
+    """
+    data = {
+        "type": msg.type,
+        "content": msg.content,
+        "id": msg.id,
+        "tool_calls": getattr(msg, "tool_calls", None)
+    }
+    tool_call_chunks = getattr(msg, "tool_call_chunks", None)
+    if tool_call_chunks is not None:
+        data["tool_call_chunks"] = tool_call_chunks
+    return data
+
+
+def is_message_list(value) -> bool:
+    """Non-empty list of LangChain messages, e.g. the messages channel."""
+    return isinstance(value, list) and bool(value) and all(isinstance(item, BaseMessage) for item in value)
+
+
+def default(obj):
+    if isinstance(obj, BaseMessage):
+        return encode_message(obj)
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def orjson_dumps(obj) -> str:
+    return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+def json_dumps(obj) -> str:
+    return json.dumps(obj, default=default)
+
+
+available_serializers = {
+    "json": json_dumps,
+}
+if orjson:
+    available_serializers["orjson"] = orjson_dumps
+
+dumps = available_serializers.get(SSE_SERIALIZER, json_dumps)
+
+
+def set_serializer(name: str):
+    """Select the serializer used by dumps(). Name must be one of the keys in available_serializers."""
+    global dumps
+    if name not in available_serializers:
+        raise ValueError(f"Unknown serializer {name}. Available: {', '.join(available_serializers)}")
+    dumps = available_serializers[name]
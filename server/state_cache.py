@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+from dotenv import load_dotenv
+from fastapi.encoders import jsonable_encoder
+from psycopg_pool import AsyncConnectionPool
+from agent.cache import LRUCache
+
+load_dotenv()
+
+# Threads whose latest state is kept in memory, and the memory used by their encoded states
+STATE_CACHE_SIZE = int(os.getenv("STATE_CACHE_SIZE", "1000"))
+STATE_CACHE_MAX_BYTES = int(os.getenv("STATE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+def encode_state(formatted: dict) -> bytes:
+    """Same encoding as a FastAPI JSONResponse of the formatted snapshot."""
+    return json.dumps(jsonable_encoder(formatted), ensure_ascii=False, allow_nan=False,
+                      separators=(",", ":")).encode()
+
+
+def format_checkpoint_payload(payload: dict) -> dict:
+    """format_state_snapshot() of the debug checkpoint event payload."""
+    interrupts = []
+    for task in payload.get("tasks") or []:
+        for interrupt in task.get("interrupts") or []:
+            interrupts.append({"value": interrupt["value"] if isinstance(interrupt, dict) else interrupt.value})
+    configurable = payload["config"]["configurable"]
+    return {
+        "values": payload["values"],
+        "next": payload["next"],
+        "config": {"configurable": {"thread_id": configurable["thread_id"],
+                                    "checkpoint_ns": configurable.get("checkpoint_ns", ""),
+                                    "checkpoint_id": configurable["checkpoint_id"]}},
+        "interrupts": interrupts,
+        "parent_config": payload.get("parent_config"),
+        "metadata": payload["metadata"],
+    }
+
+
+class StateCache:
+    """Latest state of recently polled threads, encoded as the /state response.
+
+    The ETag is the checkpoint id with a hash of the body: an interrupt adds pending writes
+    without a new checkpoint, so the checkpoint id alone doesn't change with the response.
+
+    Filled by /state on a miss and kept up to date from the checkpoints streamed by runs of this
+    process. Entries are dropped when the state changes without a streamed checkpoint (interrupts,
+    stopped or failed runs, forks) and after runs in exit durability, whose streamed checkpoints
+    are merged before they are stored. With validate, the checkpoint id of a hit is compared with the
+    latest one in Postgres, for runs executed by other workers.
+    """
+
+    def __init__(self, maxsize: int = STATE_CACHE_SIZE, max_bytes: int = STATE_CACHE_MAX_BYTES):
+        self.cache = LRUCache(maxsize, max_bytes=max_bytes, sizeof=lambda entry: len(entry[1]))
+        self.pool: AsyncConnectionPool | None = None
+        self.validate = False
+        self.stale = 0
+        self.not_modified = 0
+        self.updates = 0
+        # Threads read from the db by /state at the moment
+        self.loading: dict[str, int] = {}
+
+    def setup(self, pool: AsyncConnectionPool, validate: bool):
+        self.pool = pool
+        self.validate = validate
+
+    async def latest_checkpoint_id(self, thread_id: str) -> str | None:
+        async with self.pool.connection() as conn:
+            cursor = await conn.execute(
+                "SELECT checkpoint_id FROM checkpoints WHERE thread_id = %s AND checkpoint_ns = '' "
+                "ORDER BY checkpoint_id DESC LIMIT 1", (thread_id,))
+            row = await cursor.fetchone()
+            return row["checkpoint_id"] if row else None
+
+    async def get(self, thread_id: str) -> tuple[str, bytes, str] | None:
+        """(checkpoint_id, body, etag) or None."""
+        entry = self.cache.get(thread_id)
+        if entry is not None and self.validate and await self.latest_checkpoint_id(thread_id) != entry[0]:
+            self.cache.delete(thread_id)
+            self.stale += 1
+            return None
+        return entry
+
+    def set(self, thread_id: str, checkpoint_id: str, formatted: dict) -> tuple[str, bytes, str]:
+        """Store the state unless a newer checkpoint is cached (checkpoint ids are ordered by time).
+        Returns the cached entry."""
+        current = self.cache.peek(thread_id)
+        if current is not None and current[0] > checkpoint_id:
+            return current
+        body = encode_state(formatted)
+        entry = checkpoint_id, body, f'"{checkpoint_id}-{hashlib.sha256(body).hexdigest()[:16]}"'
+        self.cache.set(thread_id, entry)
+        return entry
+
+    def start_loading(self, thread_id: str):
+        """Called before reading a missing state from the db. Checkpoints streamed meanwhile are cached,
+        so the state read from the db doesn't replace a newer one."""
+        self.loading[thread_id] = self.loading.get(thread_id, 0) + 1
+
+    def done_loading(self, thread_id: str):
+        self.loading[thread_id] -= 1
+        if not self.loading[thread_id]:
+            del self.loading[thread_id]
+
+    def update(self, payload: dict):
+        """Update the state of a cached thread from a streamed debug checkpoint payload.
+        Threads nobody polls are not encoded."""
+        configurable = payload["config"]["configurable"]
+        thread_id = configurable["thread_id"]
+        if configurable.get("checkpoint_ns") or (thread_id not in self.cache and thread_id not in self.loading):
+            return
+        self.set(thread_id, configurable["checkpoint_id"], format_checkpoint_payload(payload))
+        self.updates += 1
+
+    def invalidate(self, thread_id: str):
+        self.cache.delete(thread_id)
+
+    def stats(self) -> dict:
+        return {**self.cache.stats(), "stale": self.stale, "not_modified": self.not_modified, "updates": self.updates}
+
+
+state_cache = StateCache()
@@ -0,0 +1,437 @@
+import asyncio
+import os
+from collections import deque
+from typing import AsyncGenerator
+import psycopg
+from dotenv import load_dotenv
+from psycopg_pool import AsyncConnectionPool
+
+load_dotenv()
+
+# Events of a run kept in memory for reconnecting clients. Older events are spilled to Postgres.
+STREAM_REPLAY_BUFFER_SIZE = int(os.getenv("STREAM_REPLAY_BUFFER_SIZE", "1000"))
+# Events moved to Postgres at once when the memory buffer is full
+STREAM_SPILL_BATCH_SIZE = int(os.getenv("STREAM_SPILL_BATCH_SIZE", "100"))
+# Seconds a finished run can still be resumed. Spilled events are deleted after this time.
+STREAM_REPLAY_TTL = float(os.getenv("STREAM_REPLAY_TTL", "300"))
+# Live events waiting for one subscriber. A subscriber falling further behind is dropped, it can resume.
+STREAM_SUBSCRIBER_QUEUE_SIZE = int(os.getenv("STREAM_SUBSCRIBER_QUEUE_SIZE", "500"))
+# Seconds a run keeps going after its last client disconnected, waiting for a reconnect. 0 stops it right away.
+STREAM_RECONNECT_GRACE = float(os.getenv("STREAM_RECONNECT_GRACE", "30"))
+# Shared streams (Postgres run coordination): seconds between writes of new events to Postgres,
+# and between reads of a run followed from another worker
+STREAM_WRITE_INTERVAL = float(os.getenv("STREAM_WRITE_INTERVAL", "0.05"))
+STREAM_FOLLOW_INTERVAL = float(os.getenv("STREAM_FOLLOW_INTERVAL", "0.2"))
+
+INSERT_EVENTS = ("INSERT INTO agent_run_events (run_id, seq, event, data) VALUES (%s, %s, %s, %s) "
+                 "ON CONFLICT DO NOTHING")
+
+
+def event_id(run_id: str, seq: int) -> str:
+    return f"{run_id}:{seq}"
+
+
+def parse_event_id(value: str | None) -> tuple[str | None, int]:
+    """Split a Last-Event-ID into run id and sequence number. (None, 0) if it is missing or invalid."""
+    run_id, _, seq = (value or "").rpartition(":")
+    if not run_id or not seq.isdigit():
+        return None, 0
+    return run_id, int(seq)
+
+
+class Subscriber:
+    """Live events of one connection. The run never waits for it: if more than maxsize events are
+    waiting, the subscriber is dropped and its stream ends. The client can resume with Last-Event-ID."""
+
+    def __init__(self, maxsize: int = STREAM_SUBSCRIBER_QUEUE_SIZE):
+        self.maxsize = maxsize
+        # Unbounded so END and DROPPED always fit. The bound is checked in offer().
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.dropped = False
+
+    def offer(self, event: dict) -> bool:
+        if self.queue.qsize() >= self.maxsize:
+            return False
+        self.queue.put_nowait(event)
+        return True
+
+
+# Put in the subscriber queues when the run is finished or the subscriber is dropped
+END = object()
+DROPPED = object()
+
+
+class RunStream:
+    """Events of one run, numbered from 1. The id of every event is "<run_id>:<seq>".
+
+    Events are published once and broadcast to the queues of all subscribers. A subscriber
+    attaching late (or resuming after Last-Event-ID) first receives the earlier events from the
+    replay buffer. The newest events are kept in memory. When there are more than maxsize,
+    the oldest ones are written to the agent_run_events table before they are dropped,
+    so a reader always finds them in one of the two places.
+
+    Shared streams write every event to agent_run_events shortly after it is published, so the run
+    can be followed from other workers (see RemoteRunStream). The memory buffer then only drops
+    events that are written.
+    """
+
+    def __init__(self, run_id: str, thread_id: str, pool: AsyncConnectionPool | None,
+                 stop_event: asyncio.Event | None = None, reconnect_grace: float = STREAM_RECONNECT_GRACE,
+                 maxsize: int = STREAM_REPLAY_BUFFER_SIZE, spill_batch_size: int = STREAM_SPILL_BATCH_SIZE,
+                 shared: bool = False):
+        self.run_id = run_id
+        self.thread_id = thread_id
+        self.pool = pool
+        self.maxsize = maxsize
+        self.spill_batch_size = max(1, spill_batch_size)
+        self.events: deque[tuple[int, dict]] = deque()
+        self.seq = 0
+        self.done = False
+        self.spilled = 0
+        self.subscribers: list[Subscriber] = []
+        self.dropped_subscribers = 0
+        # Set reconnect_grace seconds after the last subscriber disconnected, unless one reconnects.
+        # None for detached runs, which run until they finish.
+        self.stop_event = stop_event
+        self.reconnect_grace = reconnect_grace
+        self.idle_timer: asyncio.TimerHandle | None = None
+        # Shared streams: events not written yet, the last written sequence number and the writer task
+        self.shared = shared and pool is not None
+        self.unwritten: list[tuple[int, dict]] = []
+        self.written = 0
+        self.writer: asyncio.Task | None = None
+        self.follower_check: asyncio.Task | None = None
+
+    async def publish(self, event: dict):
+        self.seq += 1
+        event = {**event, "id": event_id(self.run_id, self.seq)}
+        self.events.append((self.seq, event))
+        for subscriber in list(self.subscribers):
+            if not subscriber.offer(event):
+                self.drop(subscriber)
+        if self.shared:
+            self.unwritten.append((self.seq, event))
+            if self.writer is None or self.writer.done():
+                self.writer = asyncio.create_task(self.write_later())
+            # Events are in Postgres once written, the buffer grows while writes fail
+            while len(self.events) > self.maxsize and self.events[0][0] <= self.written:
+                self.events.popleft()
+        elif len(self.events) > self.maxsize:
+            await self.spill()
+
+    async def write_later(self):
+        await asyncio.sleep(STREAM_WRITE_INTERVAL)
+        await self.write()
+
+    async def write(self):
+        """Write the unwritten events of a shared stream. Failed writes are retried by the next write."""
+        while self.unwritten:
+            batch = self.unwritten[:self.spill_batch_size]
+            try:
+                async with self.pool.connection() as conn:
+                    async with conn.cursor() as cursor:
+                        await cursor.executemany(INSERT_EVENTS, [(self.run_id, seq, event["event"], event["data"])
+                                                                 for seq, event in batch])
+            except psycopg.Error as e:
+                print(f"Error writing events of run {self.run_id}: {str(e)}")
+                return
+            del self.unwritten[:len(batch)]
+            self.written = batch[-1][0]
+
+    def drop(self, subscriber: Subscriber):
+        print(f"Dropping slow subscriber of run {self.run_id}")
+        self.subscribers.remove(subscriber)
+        self.dropped_subscribers += 1
+        subscriber.dropped = True
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(DROPPED)
+
+    async def finish(self):
+        self.done = True
+        if self.shared:
+            if self.writer is not None:
+                await self.writer
+            await self.write()
+        if self.idle_timer is not None:
+            self.idle_timer.cancel()
+            self.idle_timer = None
+        for subscriber in self.subscribers:
+            subscriber.queue.put_nowait(END)
+
+    async def spill(self):
+        if self.pool is None:
+            self.events.popleft()
+            return
+        batch = [self.events[i] for i in range(min(self.spill_batch_size, len(self.events)))]
+        try:
+            async with self.pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.executemany(INSERT_EVENTS, [(self.run_id, seq, event["event"], event["data"])
+                                                             for seq, event in batch])
+        except psycopg.Error as e:
+            # Keep the events in memory, the buffer grows until the next successful spill
+            print(f"Error spilling events of run {self.run_id}: {str(e)}")
+            return
+        for _ in batch:
+            self.events.popleft()
+        self.spilled += len(batch)
+
+    async def read_spilled(self, after: int, before: int) -> list[tuple[int, dict]]:
+        async with self.pool.connection() as conn:
+            cursor = await conn.execute(
+                "SELECT seq, event, data FROM agent_run_events WHERE run_id = %s AND seq > %s AND seq < %s ORDER BY seq",
+                (self.run_id, after, before))
+            return [(row["seq"], {"event": row["event"], "data": row["data"], "id": event_id(self.run_id, row["seq"])})
+                    for row in await cursor.fetchall()]
+
+    async def replay(self, after: int, until: int) -> AsyncGenerator[dict, None]:
+        """Events with after < seq <= until from memory and Postgres."""
+        while after < until:
+            first = self.events[0][0] if self.events else self.seq + 1
+            if after + 1 < first:
+                # Older events were spilled. Events spilled while this reader waits are read in the next loop.
+                spilled = await self.read_spilled(after, min(first, until + 1)) if self.pool is not None else []
+                if not spilled:
+                    print(f"Events {after + 1}-{first - 1} of run {self.run_id} are not available")
+                    after = first - 1
+                for seq, event in spilled:
+                    yield event
+                    after = seq
+                continue
+            for seq, event in list(self.events):
+                if after < seq <= until:
+                    yield event
+                    after = seq
+            break
+
+    async def read(self, after: int = 0) -> AsyncGenerator[dict, None]:
+        """Events with a sequence number greater than after, then new events until the run is finished."""
+        subscriber = None
+        replay_until = self.seq
+        if not self.done:
+            # Events published from now on go to the queue, earlier ones are replayed first
+            subscriber = Subscriber()
+            self.subscribers.append(subscriber)
+            if self.idle_timer is not None:
+                self.idle_timer.cancel()
+                self.idle_timer = None
+        try:
+            async for event in self.replay(after, replay_until):
+                yield event
+            if subscriber is None:
+                return
+            while True:
+                event = await subscriber.queue.get()
+                if event is END or event is DROPPED:
+                    return
+                yield event
+        finally:
+            if subscriber is not None and not subscriber.dropped and subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+            if not self.subscribers and not self.done and self.stop_event is not None:
+                if self.reconnect_grace > 0:
+                    self.idle_timer = asyncio.get_running_loop().call_later(self.reconnect_grace, self.on_idle)
+                else:
+                    self.stop_event.set()
+
+    def on_idle(self):
+        """Stop the run nobody reconnected to. Shared streams first check for followers on other workers."""
+        self.idle_timer = None
+        if self.subscribers or self.done:
+            return
+        if not self.shared:
+            self.stop_event.set()
+            return
+        self.follower_check = asyncio.create_task(self.stop_unless_followed())
+
+    async def stop_unless_followed(self):
+        try:
+            async with self.pool.connection() as conn:
+                cursor = await conn.execute(
+                    "SELECT followed_at > now() - make_interval(secs => %s) AS followed FROM agent_run_streams "
+                    "WHERE run_id = %s", (self.reconnect_grace, self.run_id))
+                row = await cursor.fetchone()
+        except psycopg.Error as e:
+            print(f"Error checking followers of run {self.run_id}: {str(e)}")
+            row = None
+        if self.subscribers or self.done:
+            return
+        if row and row["followed"]:
+            self.idle_timer = asyncio.get_running_loop().call_later(self.reconnect_grace, self.on_idle)
+        else:
+            self.stop_event.set()
+
+
+class RemoteRunStream:
+    """Shared stream of a run executed by another worker, read from agent_run_events.
+
+    Polls for new events until the run is finished. Every poll refreshes followed_at, so the
+    worker running the graph doesn't stop the run while a client follows it from here.
+    """
+
+    def __init__(self, run_id: str, thread_id: str, pool: AsyncConnectionPool,
+                 interval: float = STREAM_FOLLOW_INTERVAL, batch_size: int = STREAM_SPILL_BATCH_SIZE):
+        self.run_id = run_id
+        self.thread_id = thread_id
+        self.pool = pool
+        self.interval = interval
+        self.batch_size = batch_size
+
+    async def read(self, after: int = 0) -> AsyncGenerator[dict, None]:
+        while True:
+            async with self.pool.connection() as conn:
+                # done is read first: the events of a done run are all written
+                cursor = await conn.execute(
+                    "UPDATE agent_run_streams SET followed_at = now() WHERE run_id = %s "
+                    "RETURNING finished_at IS NOT NULL AS done",
+                    (self.run_id,))
+                row = await cursor.fetchone()
+                cursor = await conn.execute(
+                    "SELECT seq, event, data FROM agent_run_events WHERE run_id = %s AND seq > %s "
+                    "ORDER BY seq LIMIT %s", (self.run_id, after, self.batch_size))
+                rows = await cursor.fetchall()
+            for event in rows:
+                yield {"event": event["event"], "data": event["data"], "id": event_id(self.run_id, event["seq"])}
+                after = event["seq"]
+            if rows:
+                continue
+            if row is None or row["done"]:
+                return
+            await asyncio.sleep(self.interval)
+
+
+class RunStreams:
+    """Streams of the running and recently finished runs of this process.
+    Runs are executed independently of the connections, any number of subscribers can attach to a stream.
+
+    With shared streams (Postgres run coordination) runs are registered in agent_run_streams and
+    their events written to Postgres, so a client reconnecting to another worker can resume.
+    """
+
+    def __init__(self, ttl: float = STREAM_REPLAY_TTL):
+        self.ttl = ttl
+        self.streams: dict[str, RunStream] = {}
+        self.latest_by_thread: dict[str, str] = {}
+        self.pool: AsyncConnectionPool | None = None
+        self.shared = False
+        # Subscribers dropped by forgotten streams
+        self.dropped_subscribers = 0
+
+    async def setup(self, pool: AsyncConnectionPool, shared: bool = False):
+        async with pool.connection() as conn:
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS agent_run_events (
+                    run_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    event TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    PRIMARY KEY (run_id, seq)
+                )
+            """)
+            if shared:
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS agent_run_streams (
+                        run_id TEXT PRIMARY KEY,
+                        thread_id TEXT NOT NULL,
+                        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                        finished_at TIMESTAMPTZ,
+                        followed_at TIMESTAMPTZ
+                    )
+                """)
+                await conn.execute(
+                    "CREATE INDEX IF NOT EXISTS agent_run_streams_thread_idx ON agent_run_streams (thread_id, created_at)")
+        self.pool = pool
+        self.shared = shared
+        await self.prune()
+
+    async def prune(self):
+        """Delete spilled events of runs that can't be resumed anymore."""
+        try:
+            async with self.pool.connection() as conn:
+                if self.shared:
+                    # Events of running shared streams and of runs finished less than ttl ago are kept
+                    await conn.execute("""
+                        DELETE FROM agent_run_events e
+                        WHERE created_at < now() - make_interval(secs => %(ttl)s) AND NOT EXISTS (
+                            SELECT 1 FROM agent_run_streams r WHERE r.run_id = e.run_id
+                              AND (r.finished_at IS NULL OR r.finished_at > now() - make_interval(secs => %(ttl)s)))
+                    """, {"ttl": self.ttl})
+                    # Runs of crashed workers are never finished, they are deleted after a day
+                    await conn.execute(
+                        "DELETE FROM agent_run_streams WHERE finished_at < now() - make_interval(secs => %s) "
+                        "OR created_at < now() - interval '1 day'", (self.ttl,))
+                else:
+                    await conn.execute(
+                        "DELETE FROM agent_run_events WHERE created_at < now() - make_interval(secs => %s)", (self.ttl,))
+        except psycopg.Error as e:
+            print(f"Error pruning run events: {str(e)}")
+
+    async def create(self, run_id: str, thread_id: str, stop_event: asyncio.Event | None = None) -> RunStream:
+        stream = RunStream(run_id, thread_id, self.pool, stop_event, shared=self.shared)
+        if self.shared:
+            async with self.pool.connection() as conn:
+                await conn.execute("INSERT INTO agent_run_streams (run_id, thread_id) VALUES (%s, %s)",
+                                   (run_id, thread_id))
+        self.streams[run_id] = stream
+        self.latest_by_thread[thread_id] = run_id
+        return stream
+
+    async def get(self, run_id: str | None = None,
+                  thread_id: str | None = None) -> RunStream | RemoteRunStream | None:
+        """Stream of the run, or of the latest run of the thread if run_id is not given.
+        With shared streams, runs of other workers are found in Postgres."""
+        local_run_id = run_id or (self.latest_by_thread.get(thread_id) if thread_id is not None else None)
+        if local_run_id in self.streams and (run_id or not self.shared):
+            return self.streams[local_run_id]
+        if not self.shared:
+            return None
+        async with self.pool.connection() as conn:
+            if run_id:
+                cursor = await conn.execute(
+                    "SELECT run_id, thread_id FROM agent_run_streams WHERE run_id = %s", (run_id,))
+            else:
+                cursor = await conn.execute(
+                    "SELECT run_id, thread_id FROM agent_run_streams WHERE thread_id = %s "
+                    "ORDER BY created_at DESC LIMIT 1", (thread_id,))
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        if row["run_id"] in self.streams:
+            return self.streams[row["run_id"]]
+        return RemoteRunStream(row["run_id"], row["thread_id"], self.pool)
+
+    async def finish(self, stream: RunStream):
+        """Mark the run as finished and keep its events for ttl seconds."""
+        await stream.finish()
+        if stream.shared:
+            try:
+                async with self.pool.connection() as conn:
+                    await conn.execute("UPDATE agent_run_streams SET finished_at = now() WHERE run_id = %s", (stream.run_id,))
+            except psycopg.Error as e:
+                print(f"Error finishing run stream {stream.run_id}: {str(e)}")
+        asyncio.get_running_loop().call_later(self.ttl, self.forget, stream)
+        if (stream.spilled or stream.shared) and self.pool is not None:
+            await self.prune()
+
+    def forget(self, stream: RunStream):
+        self.dropped_subscribers += stream.dropped_subscribers
+        self.streams.pop(stream.run_id, None)
+        if self.latest_by_thread.get(stream.thread_id) == stream.run_id:
+            del self.latest_by_thread[stream.thread_id]
+
+    def stats(self) -> dict:
+        return {
+            "streams": len(self.streams),
+            "running": sum(not stream.done for stream in self.streams.values()),
+            "subscribers": sum(len(stream.subscribers) for stream in self.streams.values()),
+            "dropped_subscribers": self.dropped_subscribers + sum(stream.dropped_subscribers
+                                                                  for stream in self.streams.values()),
+            "buffered_events": sum(len(stream.events) for stream in self.streams.values()),
+            "spilled_events": sum(stream.spilled for stream in self.streams.values()),
+            "shared": self.shared,
+        }
+
+
+run_streams = RunStreams()
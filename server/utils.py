@@ -1,43 +1,124 @@
+import asyncio
 import json
+import os
+import time
+from langchain_core.messages import BaseMessageChunk
 from langgraph.types import StateSnapshot
+import serializers
 
+# In delta mode every n-th checkpoint event carries the full message list
+CHECKPOINT_KEYFRAME_INTERVAL = int(os.getenv("CHECKPOINT_KEYFRAME_INTERVAL", "20"))
+# Message chunks of the same message are merged for up to this many milliseconds. 0 disables merging.
+MESSAGE_CHUNK_WINDOW_MS = int(os.getenv("MESSAGE_CHUNK_WINDOW_MS", "30"))
+# Merged chunk is sent as soon as its content reaches this size in UTF-8 bytes
+MESSAGE_CHUNK_MAX_BYTES = int(os.getenv("MESSAGE_CHUNK_MAX_BYTES", "1024"))
 
-def checkpoint_event(value):
-    """Create a checkpoint event for the client."""
+# Put in the queue by pump_stream when the stream is finished
+STREAM_END = object()
+# Put in the queue by pump_stream when its task is cancelled
+STREAM_STOPPED = object()
 
-    def format_values(values: dict):
-        formatted_values = values.copy()
-        if "messages" in formatted_values:
-            formatted_values["messages"] = [
-                {
-                    "type": msg.get("type") if isinstance(msg, dict) else msg.type,
-                    "content": msg.get("content") if isinstance(msg, dict) else msg.content,
-                    "id": msg.get("id") if isinstance(msg, dict) else msg.id,
-                    "tool_calls": msg.get("tool_calls") if isinstance(msg, dict) else (msg.tool_calls if hasattr(msg, 'tool_calls') else None)
-                }
-                for msg in formatted_values["messages"]
-            ]
-        return formatted_values
 
-    def format_writes(writes: dict):
-        if writes is None:
-            return None
-        formatted_writes = {}
-        for key, value in writes.items():
-            if isinstance(value, dict):
-                formatted_writes[key] = format_values(value)
-            elif isinstance(value, list):
-                formatted_writes[key] = [format_values(item) if isinstance(
-                    item, dict) else item for item in value]
-            else:
-                formatted_writes[key] = value
-        return formatted_writes
+async def pump_stream(stream, queue: asyncio.Queue):
+    """Read the graph stream into the queue, so the consumer can wait for chunks with a timeout.
+    Exception raised by the stream is put in the queue and should be re-raised by the consumer.
+    If the task is cancelled, the graph stream is cancelled with it (including running nodes),
+    chunks not read yet are dropped and STREAM_STOPPED is put in the queue.
+    """
+    try:
+        try:
+            async for chunk in stream:
+                await queue.put(chunk)
+        except Exception as e:
+            await queue.put(e)
+        await queue.put(STREAM_END)
+    except asyncio.CancelledError:
+        # Also when cancelled while waiting for room in a full queue
+        stream_stopped(queue)
+        raise
+
+
+def stream_stopped(queue: asyncio.Queue):
+    """Drop the chunks not read yet and put STREAM_STOPPED in the queue."""
+    while not queue.empty():
+        queue.get_nowait()
+    queue.put_nowait(STREAM_STOPPED)
+
+
+class MessagesDelta:
+    """Remembers the messages already sent on one event stream.
+
+    Used by checkpoint_event in delta mode to send only the new or changed messages
+    instead of the whole list. The client rebuilds the list from the previous one:
+    keeps the first `keep` messages, replaces `update` messages by id and appends `append`.
+    Every `keyframe_interval` checkpoints (or when the list can't be expressed as a delta,
+    e.g. after a message removal) the full list is sent with keyframe set to true.
+    """
+
+    def __init__(self, keyframe_interval: int = CHECKPOINT_KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self.sent_ids: list[str] = []
+        self.fingerprints: dict[str, tuple] = {}
+        # First event of the stream is always a keyframe
+        self.events_since_keyframe = keyframe_interval
+
+    @staticmethod
+    def fingerprint(msg):
+        """Change detection of the fields sent to the client (type, content, tool calls).
+        String hashes are cached by Python so this doesn't rescan content. Tool calls are small,
+        they are hashed with their args."""
+        if isinstance(msg, dict):
+            msg_type, content, tool_calls = msg.get("type"), msg.get("content"), msg.get("tool_calls")
+        else:
+            msg_type, content, tool_calls = msg.type, msg.content, getattr(msg, "tool_calls", None)
+        content_key = hash(content) if isinstance(content, str) else hash(repr(content))
+        tool_calls_key = hash(json.dumps(tool_calls, sort_keys=True, default=str)) if tool_calls else None
+        return msg_type, content_key, tool_calls_key
+
+    def encode(self, messages: list) -> dict:
+        ids = [msg.get("id") if isinstance(msg, dict) else msg.id for msg in messages]
+        fingerprints = [self.fingerprint(msg) for msg in messages]
+
+        keep = len(self.sent_ids)
+        is_delta = (
+            self.events_since_keyframe < self.keyframe_interval
+            and None not in ids
+            and ids[:keep] == self.sent_ids
+        )
+
+        if is_delta:
+            update = [msg for msg, msg_id, fp in zip(messages[:keep], ids, fingerprints)
+                      if self.fingerprints.get(msg_id) != fp]
+            delta = {"keyframe": False, "keep": keep, "update": update, "append": messages[keep:]}
+            self.events_since_keyframe += 1
+        else:
+            delta = {"keyframe": True, "keep": 0, "update": [], "append": messages}
+            self.events_since_keyframe = 0
+
+        self.sent_ids = ids
+        self.fingerprints = dict(zip(ids, fingerprints))
+        return delta
+
+
+def checkpoint_event(value, messages_delta: MessagesDelta | None = None):
+    """Create a checkpoint event for the client.
+
+    If messages_delta is passed, values.messages is replaced by a messages_delta
+    field (see MessagesDelta).
+    Messages are not copied, they are encoded directly by the serializer.
+    """
 
     configurable = value["payload"]["config"]["configurable"]
     # print(f"WRITES {value["payload"]}")
+    values = value["payload"]["values"]
+    delta = None
+    if messages_delta is not None and "messages" in values:
+        delta = messages_delta.encode(values["messages"])
+        values = {k: v for k, v in values.items() if k != "messages"}
+
     data = {
         "next": value["payload"]["next"],
-        "values": format_values(value["payload"]["values"]),
+        "values": values,
         "config": {
             "configurable": {
                 "checkpoint_id": configurable["checkpoint_id"],
@@ -48,46 +129,104 @@ def checkpoint_event(value):
         "metadata": {
             "source": value["payload"]["metadata"]["source"],
             "step": value["payload"]["metadata"]["step"],
-            "writes": format_writes(value["payload"]["metadata"]["writes"]),
+            "writes": value["payload"]["metadata"]["writes"],
             "parents": value["payload"]["metadata"]["parents"]
         }
     }
+    if delta is not None:
+        data["messages_delta"] = delta
     return {
         "event": "checkpoint",
-        "data": json.dumps(data)
+        "data": serializers.dumps(data)
     }
 
 
 def message_chunk_event(node_name, message_chunk):
     """Create a message chunk event for the client."""
-
-    def format_messages(value):
-        """Format message chunk into a serializable dictionary.
-        This is needed because the message class is not serializable.
-        """
-        return {
-            "content": value.content,
-            "id": value.id,
-            "tool_calls": value.tool_calls if hasattr(value, 'tool_calls') else None,
-            "tool_call_chunks": value.tool_call_chunks if hasattr(value, 'tool_call_chunks') else None
-        }
-
     return {
         "event": "message_chunk",
-        "data": json.dumps({
+        "data": serializers.dumps({
             "node_name": node_name,
-            "message_chunk": format_messages(message_chunk)
+            "message_chunk": message_chunk
         })
     }
 
 
+def content_bytes(content) -> int:
+    """UTF-8 size of a message content, text or list of content parts (measured as JSON)."""
+    if isinstance(content, str):
+        return len(content.encode())
+    return len(json.dumps(content, default=str).encode())
+
+
+class MessageChunkCoalescer:
+    """Merges consecutive LLM token chunks of the same node and message into one message_chunk event.
+
+    A merged chunk is sent when the window has passed since its first chunk, when its content
+    reaches max_bytes (UTF-8), or when a chunk of another node or message arrives.
+    Chunks with tool call chunks are never delayed. Call flush() before sending any other event
+    so the client receives events in order.
+    """
+
+    def __init__(self, window_ms: int = MESSAGE_CHUNK_WINDOW_MS, max_bytes: int = MESSAGE_CHUNK_MAX_BYTES):
+        self.window = window_ms / 1000
+        self.max_bytes = max_bytes
+        self.node_name = None
+        self.chunk = None
+        self.size = 0
+        self.started_at = 0.0
+
+    def timeout(self) -> float | None:
+        """Seconds until the buffered chunk has to be sent. None if nothing is buffered."""
+        if self.chunk is None:
+            return None
+        return max(0.0, self.started_at + self.window - time.monotonic())
+
+    def flush(self) -> list[dict]:
+        if self.chunk is None:
+            return []
+        event = message_chunk_event(self.node_name, self.chunk)
+        self.node_name = None
+        self.chunk = None
+        return [event]
+
+    def add(self, node_name, message_chunk) -> list[dict]:
+        """Add the chunk and return the events that are ready to be sent."""
+        if self.window <= 0 or not isinstance(message_chunk, BaseMessageChunk):
+            return self.flush() + [message_chunk_event(node_name, message_chunk)]
+
+        if getattr(message_chunk, "tool_call_chunks", None):
+            if self.chunk is not None and self.node_name == node_name and self.chunk.id == message_chunk.id:
+                message_chunk = self.chunk + message_chunk
+                self.chunk = None
+            return self.flush() + [message_chunk_event(node_name, message_chunk)]
+
+        events = []
+        if self.chunk is not None and (self.node_name != node_name or self.chunk.id != message_chunk.id):
+            events = self.flush()
+
+        if self.chunk is None:
+            self.node_name = node_name
+            self.chunk = message_chunk
+            self.size = 0
+            self.started_at = time.monotonic()
+        else:
+            self.chunk = self.chunk + message_chunk
+
+        # Counted per chunk so the merged content isn't encoded again on every token
+        self.size += content_bytes(message_chunk.content)
+        if self.size >= self.max_bytes or time.monotonic() - self.started_at >= self.window:
+            events += self.flush()
+        return events
+
+
 def interrupt_event(interrupts):
     """Create an interrupt event for the client."""
     formatted_interrupts = [{"value": interrupt["value"]}
                             for interrupt in interrupts]
     return {
         "event": "interrupt",
-        "data": json.dumps(formatted_interrupts)
+        "data": serializers.dumps(formatted_interrupts)
     }
 
 
@@ -95,7 +234,35 @@ def custom_event(value):
     """Create a custom event for the client."""
     return {
         "event": "custom",
-        "data": json.dumps(value)
+        "data": serializers.dumps(value)
+    }
+
+
+def stopped_event(snapshot: StateSnapshot):
+    """Create a stopped event with the last checkpoint saved before the run was cancelled.
+    Running it again (replay) continues with the nodes in next.
+    """
+    configurable = snapshot.config["configurable"]
+    return {
+        "event": "stopped",
+        "data": serializers.dumps({
+            "next": snapshot.next,
+            "config": {
+                "configurable": {
+                    "checkpoint_id": configurable.get("checkpoint_id"),
+                    "checkpoint_ns": configurable.get("checkpoint_ns", ""),
+                    "thread_id": configurable["thread_id"]
+                }
+            }
+        })
+    }
+
+
+def error_event(error: Exception):
+    """Create an error event for the client. Sent when the run fails."""
+    return {
+        "event": "error",
+        "data": serializers.dumps({"error": str(error)})
     }
 
 